@@ -1,7 +1,14 @@
 '''Provides the interface to the Flask app.
 
-Creates the Flask app instance so `run.py` can run it. Also defines the
-app configuration.
+`create_app` builds a Flask app configured from the environment, with
+the extensions, routes, compression and its own cache. The app `run.py`
+and gunicorn serve is created once at import as `app`.
+
+Under gunicorn with `preload_app`, the master imports this module and
+runs `warm_up`, so forked workers share the loaded modules and compiled
+templates copy-on-write instead of each loading their own. Each worker
+then runs `init_worker` to drop what it must not share with the master,
+such as pooled database connections.
 
 '''
 import dotenv
@@ -11,22 +18,117 @@ from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_mobility import Mobility
 
+import gc
+import io
 import os
 
+from app.caching import create_cache
+from app.replicas import RoutingSession, replica_binds
+
 
 dotenv.load_dotenv()
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY')
-db_url = os.environ.get('DATABASE_URL')
-if db_url.startswith('postgres://'):
-    db_url = db_url.replace('postgres://', 'postgresql://', 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+bcrypt = Bcrypt()
+mobility = Mobility()
+
+
+def configure(app):
+    app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY')
+    db_url = os.environ.get('DATABASE_URL')
+    if db_url.startswith('postgres://'):
+        db_url = db_url.replace('postgres://', 'postgresql://', 1)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+    replica_urls = os.environ.get('REPLICA_DATABASE_URLS', '').replace('postgres://', 'postgresql://')
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(replica_urls)
+    app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 5))
+    app.config['REPLICA_LAG_CHECK_INTERVAL'] = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 1))
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if not db_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'pool_pre_ping': True,
+        }
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['HASH_EXECUTOR'] = os.environ.get('HASH_EXECUTOR', 'thread')
+    app.config['HASH_MAX_WORKERS'] = int(os.environ.get('HASH_MAX_WORKERS', 2))
+    app.config['HASH_MAX_QUEUED'] = int(os.environ.get('HASH_MAX_QUEUED', 16))
+    app.config['HASH_QUEUE_TIMEOUT'] = float(os.environ.get('HASH_QUEUE_TIMEOUT', 5))
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_SQLITE_PATH'] = os.environ.get('CACHE_SQLITE_PATH')
+    app.config['CACHE_MAX_SIZE'] = int(os.environ.get('CACHE_MAX_SIZE', 1024))
+    app.config['CACHE_DEFAULT_TTL'] = float(os.environ.get('CACHE_DEFAULT_TTL', 3600))
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    app.config['RATE_LIMIT_SQLITE_PATH'] = os.environ.get('RATE_LIMIT_SQLITE_PATH')
+    app.config['RATE_LIMIT_LEASE_SECONDS'] = float(os.environ.get('RATE_LIMIT_LEASE_SECONDS', 60))
+    app.config['API_RATE'] = float(os.environ.get('API_RATE', 10))
+    app.config['API_BURST'] = float(os.environ.get('API_BURST', 20))
+    app.config['API_JOBS_RATE'] = float(os.environ.get('API_JOBS_RATE', 0.2))
+    app.config['API_JOBS_BURST'] = float(os.environ.get('API_JOBS_BURST', 3))
+    app.config['API_JOBS_CONCURRENCY'] = int(os.environ.get('API_JOBS_CONCURRENCY', 2))
+    app.config['API_INSIGHTS_RATE'] = float(os.environ.get('API_INSIGHTS_RATE', 0.5))
+    app.config['API_INSIGHTS_BURST'] = float(os.environ.get('API_INSIGHTS_BURST', 5))
+    app.config['API_INSIGHTS_CONCURRENCY'] = int(os.environ.get('API_INSIGHTS_CONCURRENCY', 2))
+    app.config['ETA_MIN_SAMPLES'] = int(os.environ.get('ETA_MIN_SAMPLES', 3))
+    app.config['OVERRUN_STDEVS'] = float(os.environ.get('OVERRUN_STDEVS', 3))
+    app.config['OVERRUN_MIN_RATIO'] = float(os.environ.get('OVERRUN_MIN_RATIO', 1.1))
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    app.config['COMPRESS_BR_LEVEL'] = int(os.environ.get('COMPRESS_BR_LEVEL', 5))
+    app.config['STATIC_MAX_AGE'] = int(os.environ.get('STATIC_MAX_AGE', 31536000))
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    configure(app)
+    app.config.update(config or {})
+    db.init_app(app)
+    login_manager.init_app(app)
+    bcrypt.init_app(app)
+    mobility.init_app(app)
+    app.extensions['cache'] = create_cache(app.config)
+
+    from app import routes, compression
+    routes.register_routes(app)
+    compression.init_compression(app)
+    return app
+
+
+def warm_up(app):
+    '''Loads what workers would otherwise each load on their first
+    requests: every template, compiled, and matplotlib's font cache.
+
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    fig = Figure()
+    fig.add_subplot(1, 1, 1).set_title('warm up')
+    FigureCanvasAgg(fig).print_png(io.BytesIO())
+
+    # Keep the garbage collector from touching, and so copying, the
+    # objects loaded so far in forked workers
+    gc.collect()
+    gc.freeze()
+
+
+def init_worker(app):
+    '''Drops state a forked worker must not share with its parent.'''
+    from app import hashing, replicas
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-bcrypt = Bcrypt(app)
-mobility = Mobility(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            # Forget, without closing, connections opened in the parent
+            engine.dispose(close=False)
+    hashing.reset()
+    replicas.lag_checks.clear()
 
 
-from app import routes
+app = create_app()
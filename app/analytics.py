@@ -0,0 +1,266 @@
+'''Module for time-bucketed job analytics.
+
+Reads only `start_time`, `end_time`, `status` and `config_id` from the
+job table, streamed in chunks, and folds each chunk into NumPy counters.
+This keeps memory flat and avoids per-job Python work beyond unpacking
+rows, so a year of history can be summarised per hour, day or week.
+
+'''
+import numpy as np
+
+from datetime import datetime, timedelta
+
+from app import db, models, replicas
+
+
+STATUSES = list(models.StatusEnum)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+STARTED, STOPPED, FINISHED, FAILED = (STATUS_CODES[status] for status in (
+    models.StatusEnum.started,
+    models.StatusEnum.stopped,
+    models.StatusEnum.finished,
+    models.StatusEnum.failed,
+))
+BUCKETS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 604800,
+}
+MAX_BUCKETS = 10000
+
+
+class BucketedMetrics():
+    '''Accumulates job counts, busy time and per-config outcomes over
+    fixed-width buckets between `start` and `end`. Times are float
+    seconds, and running jobs count as busy until `now`.
+
+    '''
+
+    def __init__(self, start, end, bucket_seconds, now=None):
+        self.start = start
+        self.end = end
+        self.now = min(end, now) if now is not None else end
+        self.bucket_seconds = bucket_seconds
+        self.size = int(np.ceil((end - start) / bucket_seconds))
+        self.started = np.zeros(self.size, dtype=np.int64)
+        self.ended = np.zeros((len(STATUSES), self.size), dtype=np.int64)
+        self.busy = np.zeros(self.size, dtype=np.float64)
+        self.full_buckets = np.zeros(self.size + 1, dtype=np.int64)
+        self.config_ids = np.zeros(0, dtype=np.int64)
+        self.config_outcomes = np.zeros((0, len(STATUSES)), dtype=np.int64)
+
+    def bucket_of(self, times):
+        return np.floor((times - self.start) / self.bucket_seconds).astype(np.int64)
+
+    def add(self, starts, ends, statuses, config_ids):
+        '''Adds one chunk of jobs. `ends` holds NaN for running jobs.'''
+        in_range = (starts >= self.start) & (starts < self.end)
+        self.started += np.bincount(self.bucket_of(starts[in_range]), minlength=self.size)
+
+        has_ended = ~np.isnan(ends)
+        ended_in_range = has_ended & (ends >= self.start) & (ends < self.end)
+        ended_buckets = self.bucket_of(ends[ended_in_range])
+        ended_statuses = statuses[ended_in_range]
+        np.add.at(self.ended, (ended_statuses, ended_buckets), 1)
+
+        self.add_busy_time(starts, np.where(has_ended, ends, self.now))
+        self.add_config_outcomes(config_ids[ended_in_range], ended_statuses)
+
+    def add_busy_time(self, starts, ends):
+        starts = np.clip(starts, self.start, self.end)
+        ends = np.clip(ends, self.start, self.end)
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if not len(starts):
+            return
+
+        first = np.minimum(self.bucket_of(starts), self.size - 1)
+        last = np.minimum(self.bucket_of(ends), self.size - 1)
+        first_end = self.start + (first + 1) * self.bucket_seconds
+        last_start = self.start + last * self.bucket_seconds
+        same = first == last
+
+        # Jobs inside a single bucket, then the partial first and last
+        # buckets of longer jobs, then a difference array for the full
+        # buckets in between
+        self.busy += np.bincount(first[same], weights=ends[same] - starts[same], minlength=self.size)
+        spans = ~same
+        self.busy += np.bincount(first[spans], weights=first_end[spans] - starts[spans], minlength=self.size)
+        self.busy += np.bincount(last[spans], weights=ends[spans] - last_start[spans], minlength=self.size)
+        np.add.at(self.full_buckets, first[spans] + 1, 1)
+        np.add.at(self.full_buckets, last[spans], -1)
+
+    def add_config_outcomes(self, config_ids, statuses):
+        if not len(config_ids):
+            return
+        ids, inverse = np.unique(np.concatenate([self.config_ids, config_ids]), return_inverse=True)
+        outcomes = np.zeros((len(ids), len(STATUSES)), dtype=np.int64)
+        outcomes[inverse[:len(self.config_ids)]] += self.config_outcomes
+        np.add.at(outcomes, (inverse[len(self.config_ids):], statuses), 1)
+        self.config_ids, self.config_outcomes = ids, outcomes
+
+    def result(self):
+        busy = self.busy + np.cumsum(self.full_buckets)[:self.size] * self.bucket_seconds
+        hours = self.bucket_seconds / 3600
+        finished = self.ended[FINISHED]
+        failed = self.ended[FAILED]
+        completed = finished + failed + self.ended[STOPPED]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            failure_rate = np.where(completed > 0, failed / completed, 0.0)
+            config_completed = self.config_outcomes.sum(axis=1)
+            config_failure_rate = np.where(config_completed > 0, self.config_outcomes[:, FAILED] / config_completed, 0.0)
+
+        return {
+            'start': self.start,
+            'end': self.end,
+            'bucket_seconds': self.bucket_seconds,
+            'buckets': (self.start + np.arange(self.size) * self.bucket_seconds).tolist(),
+            'jobs_started': self.started.tolist(),
+            'jobs_finished': finished.tolist(),
+            'jobs_failed': failed.tolist(),
+            'jobs_stopped': self.ended[STOPPED].tolist(),
+            'jobs_per_hour': (finished / hours).tolist(),
+            'failure_rate': failure_rate.tolist(),
+            'utilization': np.clip(busy / self.bucket_seconds, 0, 1).tolist(),
+            'configs': [
+                {
+                    'config_id': int(config_id),
+                    'finished': int(outcomes[FINISHED]),
+                    'failed': int(outcomes[FAILED]),
+                    'stopped': int(outcomes[STOPPED]),
+                    'failure_rate': float(rate),
+                    'jobs_per_hour': float(outcomes[FINISHED] / ((self.end - self.start) / 3600)),
+                }
+                for config_id, outcomes, rate in zip(self.config_ids, self.config_outcomes, config_failure_rate)
+            ],
+        }
+
+
+def to_seconds(times):
+    '''Converts naive datetimes, or seconds already computed in SQL, to
+    float seconds since 1970-01-01 in the same wall clock, with NaN for
+    `None`.
+
+    '''
+    if any(isinstance(time, datetime) for time in times):
+        times = np.array(times, dtype='datetime64[us]')
+        seconds = times.astype(np.int64) / 1e6
+        seconds[np.isnat(times)] = np.nan
+        return seconds
+    return np.array(times, dtype=np.float64)
+
+
+def to_isoformat(seconds):
+    return np.datetime_as_string((np.asarray(seconds) * 1e6).astype('datetime64[us]'), unit='s').tolist()
+
+
+def epoch_seconds(column):
+    '''Returns a SQL expression for `column` as float seconds since
+    1970-01-01 in the same wall clock, so rows skip datetime parsing.
+
+    '''
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return db.func.extract('epoch', column)
+    if dialect == 'sqlite':
+        return (db.func.julianday(column) - 2440587.5) * 86400.0
+    return column
+
+
+def iter_job_chunks(start, end, chunk_size=50000):
+    '''Yields `(starts, ends, statuses, config_ids)` arrays for jobs that
+    overlap `[start, end)`, reading `chunk_size` rows at a time.
+
+    '''
+    job = models.PlugJob
+    status_codes = {status.name: code for status, code in STATUS_CODES.items()}
+    query = (
+        db.select(epoch_seconds(job.start_time), epoch_seconds(job.end_time), db.cast(job.status, db.String), job.config_id)
+        .where(job.start_time < end)
+        .where(db.or_(job.end_time >= start, job.end_time.is_(None)))
+        .execution_options(yield_per=chunk_size)
+    )
+    for rows in db.session.execute(query).partitions():
+        start_times, end_times, statuses, config_ids = zip(*rows)
+        yield (
+            to_seconds(start_times),
+            to_seconds(end_times),
+            np.fromiter((status_codes[status] for status in statuses), dtype=np.int64, count=len(rows)),
+            np.fromiter(config_ids, dtype=np.int64, count=len(rows)),
+        )
+
+
+def parse_bucket(bucket):
+    if bucket in BUCKETS:
+        return BUCKETS[bucket]
+    seconds = int(bucket)
+    if seconds <= 0:
+        raise ValueError('bucket must be positive')
+    return seconds
+
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    return datetime.fromisoformat(value)
+
+
+@replicas.reads
+def job_metrics(start=None, end=None, bucket='hour', chunk_size=50000):
+    '''Returns bucketed throughput, utilization and failure metrics for
+    jobs between `start` and `end`. Both may be datetimes, ISO strings or
+    timestamps. They default to the last seven days.
+
+    '''
+    end = parse_time(end) if end is not None else datetime.now()
+    start = parse_time(start) if start is not None else end - timedelta(days=7)
+    bucket_seconds = parse_bucket(bucket)
+    if end <= start:
+        raise ValueError('end must be after start')
+    if (end - start).total_seconds() / bucket_seconds > MAX_BUCKETS:
+        raise ValueError(f'Range and bucket would give more than {MAX_BUCKETS} buckets')
+
+    start_seconds, end_seconds, now_seconds = to_seconds([start, end, datetime.now()])
+    metrics = BucketedMetrics(start_seconds, end_seconds, bucket_seconds, now=now_seconds)
+    for chunk in iter_job_chunks(start, end, chunk_size):
+        metrics.add(*chunk)
+    result = metrics.result()
+    result['start'], result['end'] = to_isoformat([metrics.start, metrics.end])
+    result['buckets'] = to_isoformat(result['buckets'])
+    return result
+
+
+@replicas.reads
+def queue_metrics(window=3600):
+    '''Returns the current queue depth and the wait between queuing and
+    starting for jobs claimed in the last `window` seconds.
+
+    '''
+    job = models.PlugJob
+    now = datetime.now()
+    depth = dict(
+        db.session.query(job.priority, db.func.count(job.id))
+        .filter(job.status == models.StatusEnum.queued)
+        .group_by(job.priority)
+        .all()
+    )
+    oldest = db.session.query(db.func.min(job.queued_time)).filter(job.status == models.StatusEnum.queued).scalar()
+    waits = np.array(
+        db.session.query(epoch_seconds(job.start_time) - epoch_seconds(job.queued_time))
+        .filter(job.queued_time.isnot(None))
+        .filter(job.start_time >= now - timedelta(seconds=window))
+        .all(),
+        dtype=np.float64
+    ).ravel()
+    return {
+        'depth': sum(depth.values()),
+        'depth_by_priority': {str(priority): count for priority, count in sorted(depth.items(), reverse=True)},
+        'oldest_wait': (now - oldest).total_seconds() if oldest is not None else 0.0,
+        'window': window,
+        'claimed': len(waits),
+        'wait_p50': float(np.percentile(waits, 50)) if len(waits) else 0.0,
+        'wait_p95': float(np.percentile(waits, 95)) if len(waits) else 0.0,
+        'wait_max': float(waits.max()) if len(waits) else 0.0,
+    }
@@ -0,0 +1,216 @@
+'''Module for caches shared by the app's modules and workers.
+
+`CACHE_BACKEND` selects where cached values live:
+
+* ``memory`` (default) keeps them in the worker process, least recently
+  used first out once `CACHE_MAX_SIZE` entries are stored.
+* ``sqlite`` keeps them in the SQLite file at `CACHE_SQLITE_PATH`, shared
+  by every worker on the host.
+* ``redis`` keeps them in the Redis server at `CACHE_URL`, shared by
+  every host. It needs the `redis` package. `LocalRedis` stands in for a
+  server when trying it locally.
+
+Entries expire after `CACHE_DEFAULT_TTL` seconds unless set with their
+own TTL. Callers do not delete stale entries. Instead they put the
+`DataVersion` counters of the tables a value was built from into its
+key, so a write in any worker changes the key every worker looks up.
+
+`create_app` stores each app's cache in `app.extensions['cache']`, and
+`current_cache` returns the current app's.
+
+'''
+from flask import current_app
+
+from collections import OrderedDict
+import contextlib
+import math
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+from app.sqlitefile import SQLiteFile
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def make_key(parts):
+    return ':'.join(str(part) for part in parts) if isinstance(parts, tuple) else str(parts)
+
+
+class MemoryCache():
+
+    def __init__(self, max_size=1024, default_ttl=None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        key = make_key(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[make_key(key)] = (value, expires)
+            self.entries.move_to_end(make_key(key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(make_key(key), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache(SQLiteFile):
+    '''Stores pickled values in a SQLite file. Entries past `max_size`
+    are evicted oldest first, checked every `prune_every` sets.
+
+    '''
+
+    def __init__(self, path, max_size=1024, default_ttl=None, prune_every=100):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL, stored REAL)',
+            'CREATE INDEX IF NOT EXISTS ix_cache_stored ON cache (stored)',
+        ))
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.prune_every = prune_every
+        self.sets = 0
+
+    def get(self, key):
+        row = self.connection.execute('SELECT value, expires FROM cache WHERE key = ?', (make_key(key),)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, stored) VALUES (?, ?, ?, ?)',
+            (make_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl if ttl else None, now)
+        )
+        self.sets += 1
+        if self.sets % self.prune_every == 0:
+            self.prune(now)
+
+    def prune(self, now):
+        with contextlib.suppress(sqlite3.OperationalError):
+            self.connection.execute('DELETE FROM cache WHERE expires < ?', (now,))
+            self.connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored DESC LIMIT -1 OFFSET ?)',
+                (self.max_size,)
+            )
+
+    def delete(self, key):
+        self.connection.execute('DELETE FROM cache WHERE key = ?', (make_key(key),))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+
+class LocalRedis():
+    '''In-process stand-in for the part of a Redis client `RedisCache`
+    uses.
+
+    '''
+
+    def __init__(self):
+        self.cache = MemoryCache(max_size=float('inf'))
+
+    def get(self, name):
+        return self.cache.get(name)
+
+    def set(self, name, value, px=None):
+        self.cache.set(name, value, ttl=px / 1000 if px else None)
+
+    def delete(self, *names):
+        for name in names:
+            self.cache.delete(name)
+
+    def scan_iter(self, match=None):
+        prefix = match.rstrip('*') if match else ''
+        with self.cache.lock:
+            return [key for key in self.cache.entries if key.startswith(prefix)]
+
+
+class RedisCache():
+    '''Stores pickled values in Redis under `prefix`, so several apps can
+    share one server. Redis evicts by its own `maxmemory-policy`.
+
+    '''
+
+    def __init__(self, client, default_ttl=None, prefix='plugs:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + make_key(key))
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        # In milliseconds, rounded up, so a TTL under a second still expires
+        self.client.set(self.prefix + make_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=math.ceil(ttl * 1000) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + make_key(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_cache(config):
+    backend = config['CACHE_BACKEND']
+    max_size = config['CACHE_MAX_SIZE']
+    default_ttl = config['CACHE_DEFAULT_TTL']
+    if backend == 'sqlite':
+        path = config['CACHE_SQLITE_PATH'] or os.path.join(tempfile.gettempdir(), 'plugs_cache.db')
+        return SQLiteCache(path, max_size, default_ttl)
+    if backend == 'redis':
+        if config['CACHE_URL'] == 'local':
+            return RedisCache(LocalRedis(), default_ttl)
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis needs the redis package')
+        return RedisCache(redis.Redis.from_url(config['CACHE_URL']), default_ttl)
+    return MemoryCache(max_size, default_ttl)
+
+
+def current_cache():
+    return current_app.extensions['cache']
+
+
+def get_or_set(cache, key, compute, ttl=None):
+    '''Returns the cached value for `key`, calling `compute` and caching
+    its result on a miss.
+
+    '''
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, ttl)
+    return value
@@ -0,0 +1,162 @@
+'''Module for response compression and static asset caching.
+
+Negotiates gzip (or brotli, when the `brotli` package is installed)
+compression for text responses above a size threshold, fingerprints
+static URLs with a content hash so browsers can cache them forever, and
+serves precompressed static variants generated at startup. When the
+static folder is read-only, variants that cannot be written are skipped
+and those files are served uncompressed.
+
+'''
+from flask import current_app, request, send_from_directory
+
+import contextlib
+import gzip
+import hashlib
+import mimetypes
+import os
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'image/svg+xml',
+    'text/css',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+}
+PRECOMPRESSED_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json'}
+ENCODING_EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+
+def accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BR_LEVEL'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+
+def file_hash(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def precompress_static(app):
+    '''Hashes every static file and writes `.gz`/`.br` variants next to
+    compressible ones, skipping variants that are already up to date, or
+    all of them once one cannot be written.
+
+    '''
+    static_hashes = app.extensions['static_hashes']
+    static_hashes.clear()
+    writable = True
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            ext = os.path.splitext(name)[1]
+            if ext in ENCODING_EXTENSIONS.values():
+                continue
+            filename = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+            static_hashes[filename] = file_hash(path)
+
+            if ext not in PRECOMPRESSED_EXTENSIONS or not writable:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in ENCODING_EXTENSIONS.items():
+                if encoding == 'br' and brotli is None:
+                    continue
+                variant = path + suffix
+                if os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+                    continue
+                try:
+                    with app.app_context(), open(variant, 'wb') as f:
+                        f.write(compress(data, encoding))
+                except OSError as e:
+                    app.logger.warning('Not precompressing static files: %s', e)
+                    with contextlib.suppress(OSError):
+                        os.remove(variant)
+                    writable = False
+                    break
+
+
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = current_app.extensions['static_hashes'].get(values.get('filename'))
+        if fingerprint:
+            values['v'] = fingerprint
+
+
+def static(filename):
+    encoding = accepted_encoding()
+    sent_filename = filename
+    if encoding:
+        variant = filename + ENCODING_EXTENSIONS[encoding]
+        if os.path.isfile(os.path.join(current_app.static_folder, variant)):
+            sent_filename = variant
+        else:
+            encoding = None
+
+    response = send_from_directory(current_app.static_folder, sent_filename)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Disposition', None)
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response.vary.add('Accept-Encoding')
+
+    if request.args.get('v') and request.args.get('v') == current_app.extensions['static_hashes'].get(filename):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.status_code < 200
+        or response.status_code >= 300
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.extensions['static_hashes'] = {}
+    app.url_defaults(fingerprint_static_url)
+    app.view_functions['static'] = static
+    app.after_request(compress_response)
+    precompress_static(app)
@@ -0,0 +1,88 @@
+'''Module for compiling cure profiles into step schedules.
+
+A cure profile is a string of ``0`` and ``1`` characters, one per step
+of `STEP_MILLISECONDS`, where ``1`` turns the curing light on for that
+step. A config's profile is compiled once, when it is saved, into a
+run-length encoded schedule that controllers can run without decoding
+the profile for every job.
+
+A packed schedule is a `HEADER` of the format version, the number of
+runs and the step length in milliseconds, then one byte per run: the
+high bit is the light state and the low 7 bits the number of steps.
+Runs longer than 127 steps are split.
+
+'''
+import struct
+
+
+FORMAT_VERSION = 1
+STEP_MILLISECONDS = 1000
+MAX_STEPS = 32
+MAX_RUN_STEPS = 0x7f
+ON = 0x80
+
+HEADER = struct.Struct('<BBH')
+MAX_SCHEDULE_SIZE = HEADER.size + MAX_STEPS
+
+
+class InvalidProfile(ValueError):
+    pass
+
+
+def validate_profile(profile):
+    if not profile:
+        raise InvalidProfile('The cure profile must have at least one step')
+    if len(profile) > MAX_STEPS:
+        raise InvalidProfile(f'The cure profile can have at most {MAX_STEPS} steps')
+    if profile.strip('01'):
+        raise InvalidProfile('The cure profile may only contain 0 and 1')
+
+
+def encode_runs(profile):
+    '''Returns the profile's runs as `(on, steps)` pairs.'''
+    runs = []
+    for step in profile:
+        on = step == '1'
+        if runs and runs[-1][0] == on and runs[-1][1] < MAX_RUN_STEPS:
+            runs[-1][1] += 1
+        else:
+            runs.append([on, 1])
+    return [tuple(run) for run in runs]
+
+
+def pack_schedule(runs, step_milliseconds=STEP_MILLISECONDS):
+    header = HEADER.pack(FORMAT_VERSION, len(runs), step_milliseconds)
+    return header + bytes((ON if on else 0) | steps for on, steps in runs)
+
+
+def compile_profile(profile):
+    '''Validates `profile` and returns its packed schedule. Raises
+    `InvalidProfile` if it is not valid.
+
+    '''
+    validate_profile(profile)
+    return pack_schedule(encode_runs(profile))
+
+
+def unpack_schedule(schedule):
+    '''Returns the step length in milliseconds and the `(on, steps)` runs
+    of a packed schedule.
+
+    '''
+    version, count, step_milliseconds = HEADER.unpack_from(schedule)
+    if version != FORMAT_VERSION or len(schedule) != HEADER.size + count:
+        raise ValueError('Not a packed cure schedule')
+    return step_milliseconds, [(bool(run & ON), run & MAX_RUN_STEPS) for run in schedule[HEADER.size:]]
+
+
+def timed_steps(schedule):
+    '''Returns a packed schedule as `(start, duration, on)` tuples in
+    milliseconds from the start of the cure.
+
+    '''
+    step_milliseconds, runs = unpack_schedule(schedule)
+    steps, start = [], 0
+    for on, count in runs:
+        steps.append((start, count * step_milliseconds, on))
+        start += count * step_milliseconds
+    return steps
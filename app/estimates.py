@@ -0,0 +1,51 @@
+'''Module for estimating when active jobs will finish.
+
+Each config keeps running statistics of its finished jobs' durations in
+`DurationStats`, updated as each job finishes, so estimating the active
+jobs reads one row per config instead of the job history. A job is
+expected at its start time plus its config's mean duration. It is
+overrunning once it has run `OVERRUN_STDEVS` standard deviations past
+the mean, and at least `OVERRUN_MIN_RATIO` times the mean. Configs with
+fewer than `ETA_MIN_SAMPLES` finished jobs give no estimate.
+
+'''
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import models
+
+
+Estimate = namedtuple('Estimate', ['eta', 'overrun_time', 'overrunning'])
+NO_ESTIMATE = Estimate(None, None, False)
+
+
+def estimate(start_time, stats, now):
+    if stats is None or stats.count < current_app.config['ETA_MIN_SAMPLES']:
+        return NO_ESTIMATE
+    limit = max(stats.mean + current_app.config['OVERRUN_STDEVS'] * stats.stdev, stats.mean * current_app.config['OVERRUN_MIN_RATIO'])
+    eta = start_time + timedelta(seconds=stats.mean)
+    overrun_time = start_time + timedelta(seconds=limit)
+    return Estimate(eta, overrun_time, now > overrun_time)
+
+
+def for_jobs(jobs, now=None):
+    '''Returns the `Estimate` of each active job in `jobs` by job id.'''
+    now = now or datetime.now()
+    active = [job for job in jobs if job.is_active() and job.start_time is not None]
+    stats = models.DurationStats.get_by_configs({job.config_id for job in active})
+    return {job.id: estimate(job.start_time, stats.get(job.config_id), now) for job in active}
+
+
+def overrunning_ids(station_id=None, now=None):
+    estimates = for_jobs(models.PlugJob.get_active(station_id), now)
+    return tuple(sorted(id for id, estimate in estimates.items() if estimate.overrunning))
+
+
+def to_json(estimate):
+    return {
+        'eta': estimate.eta.timestamp() if estimate.eta else None,
+        'overrun_time': estimate.overrun_time.timestamp() if estimate.overrun_time else None,
+        'overrunning': estimate.overrunning,
+    }
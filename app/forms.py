@@ -26,7 +26,7 @@ from wtforms.validators import (
     EqualTo
 )
 
-from app import models
+from app import cure, models
 
 
 class UserSignInForm(FlaskForm):
@@ -88,6 +88,12 @@ class PlugConfigForm(FlaskForm):
     def __repr__(cls):
         return f'PlugConfigForm(name={cls.name.data}, cure_profile={cls.cure_profile.data})'
 
+    def validate_cure_profile(self, cure_profile):
+        try:
+            cure.validate_profile(cure_profile.data)
+        except cure.InvalidProfile as e:
+            raise ValidationError(str(e))
+
     # def validate_name(self, name):
     #     config = models.PlugConfig.query.filter_by(name=name.data).first()
     #     if config is not None:
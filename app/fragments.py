@@ -0,0 +1,58 @@
+'''Module for caching rendered template fragments.
+
+The jobs and configs tables only change when a job or config is written.
+Their rendered HTML is cached in the app's cache under a key built from
+the tables' `DataVersion` counters and everything else the fragment
+depends on, such as the page number, the user's sort settings and
+whether the client is mobile. A write bumps the counter, so every worker
+misses on its next request and re-renders.
+
+'''
+from flask import g, render_template, request
+
+from app import caching, estimates, models
+
+
+def cached_fragment(key, render):
+    '''Returns the cached HTML for `key`, calling `render` on a miss.'''
+    return caching.get_or_set(caching.current_cache(), key, render)
+
+
+def data_versions():
+    if 'data_versions' not in g:
+        versions = models.DataVersion.get_versions()
+        g.data_versions = tuple(versions.get(table.__tablename__, 0) for table in models.VERSIONED_TABLES)
+    return g.data_versions
+
+
+def jobs_table(page, settings, query_jobs, overrunning=()):
+    '''Overrunning jobs change with time rather than with a write, so
+    their ids are part of the key.
+
+    '''
+    def render():
+        jobs = query_jobs()
+        return render_template('tables/jobs.html', jobs=jobs, estimates=estimates.for_jobs(jobs.items))
+
+    key = ('jobs', data_versions(), page, settings.sort_by, settings.only_show_active, settings.station_id, bool(request.MOBILE), overrunning)
+    return cached_fragment(key, render)
+
+
+def configs_table(page, query_configs):
+    key = ('configs', data_versions(), page, bool(request.MOBILE))
+    return cached_fragment(key, lambda: render_template('tables/configs.html', configs=query_configs()))
+
+
+def config_options(query_configs):
+    key = ('config_options', data_versions())
+    return cached_fragment(key, lambda: render_template('tables/config_options.html', configs=query_configs()))
+
+
+def station_options(selected_id, query_stations):
+    key = ('station_options', data_versions(), selected_id)
+    return cached_fragment(key, lambda: render_template('tables/station_options.html', stations=query_stations(), selected_id=selected_id))
+
+
+def config_table(config):
+    key = ('config', config.id, config.version)
+    return cached_fragment(key, lambda: render_template('tables/config.html', config=config))
@@ -0,0 +1,39 @@
+'''Module for vectorized checks over plug geometry.
+
+Works on the (n, 4, 3) arrays returned by
+`PlugConfig.get_geometry_arrays`, so thousands of configs are checked
+with a few NumPy operations instead of a loop over ORM objects.
+
+'''
+import numpy as np
+
+from app import models
+
+
+OFFSET, VERTICAL_GAP, HORIZONTAL_GAP, SLOT_GAP = range(len(models.GEOMETRY_VECTORS))
+
+
+def gap_lengths(geometry):
+    return np.linalg.norm(geometry[:, VERTICAL_GAP:, :], axis=2)
+
+
+def spacing_violations(geometry, min_gap):
+    '''Returns a mask of configs whose vertical, horizontal or slot gap
+    is shorter than `min_gap`, which would put neighbouring plugs in the
+    rack into collision.
+
+    '''
+    return (gap_lengths(geometry) < min_gap).any(axis=1)
+
+
+def bounds_violations(geometry, low, high):
+    '''Returns a mask of configs with any component outside
+    `[low, high]`.
+
+    '''
+    return ((geometry < low) | (geometry > high)).any(axis=(1, 2))
+
+
+def find_spacing_violations(min_gap, include_archived=False):
+    ids, geometry = models.PlugConfig.get_geometry_arrays(include_archived)
+    return ids[spacing_violations(geometry, min_gap)].tolist()
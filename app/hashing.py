@@ -0,0 +1,125 @@
+'''Module for hashing and checking passwords off the request path.
+
+Bcrypt is deliberately slow, so a burst of sign-ins can occupy every
+worker. Hashes run on a small executor whose size caps how many run at
+once, with at most `HASH_MAX_QUEUED` more waiting. Callers whose hash
+has not finished within `HASH_QUEUE_TIMEOUT`, queuing included, get
+`HashingBusy` instead of waiting indefinitely. `HASH_EXECUTOR` selects
+the executor:
+
+* ``thread`` (default) runs hashes on native threads. Bcrypt releases
+  the GIL, so other requests keep running. Under gevent the hub's
+  native thread pool is used, so greenlets are not blocked.
+* ``process`` runs hashes in a process pool.
+* ``inline`` hashes on the request thread, as before, at most
+  `HASH_MAX_WORKERS` at once. Only the wait for a turn is timed out, as
+  a hash on the request thread cannot be abandoned.
+
+Hashes are compatible with `Flask-Bcrypt`, and `BCRYPT_LOG_ROUNDS` sets
+the cost used for new hashes.
+
+'''
+from flask import current_app
+import bcrypt
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+import threading
+import time
+
+
+class HashingBusy(Exception):
+    pass
+
+
+executor = None
+executor_lock = threading.Lock()
+slots = None
+
+
+def hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def checkpw(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def gevent_executor(max_workers):
+    try:
+        from gevent import monkey
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+    except ImportError:
+        return None
+    if monkey.is_module_patched('threading'):
+        return GeventThreadPoolExecutor(max_workers=max_workers)
+    return None
+
+
+def get_executor():
+    global executor, slots
+    with executor_lock:
+        if slots is None:
+            max_workers = current_app.config['HASH_MAX_WORKERS']
+            if current_app.config['HASH_EXECUTOR'] == 'inline':
+                # Waiting callers queue on the semaphore itself
+                slots = threading.BoundedSemaphore(max_workers)
+            else:
+                slots = threading.BoundedSemaphore(max_workers + current_app.config['HASH_MAX_QUEUED'])
+            if current_app.config['HASH_EXECUTOR'] == 'process':
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            elif current_app.config['HASH_EXECUTOR'] == 'thread':
+                executor = gevent_executor(max_workers) or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hashing')
+        return executor
+
+
+def reset():
+    '''Forgets the executor, whose threads or processes belong to the
+    parent after a fork. The next hash starts a new one.
+
+    '''
+    global executor, executor_lock, slots
+    executor = None
+    executor_lock = threading.Lock()
+    slots = None
+
+
+def run(func, *args):
+    pool = get_executor()
+    slot = slots
+    timeout = current_app.config['HASH_QUEUE_TIMEOUT']
+    deadline = time.monotonic() + timeout
+    if not slot.acquire(timeout=timeout):
+        raise HashingBusy()
+    if pool is None:
+        try:
+            return func(*args)
+        finally:
+            slot.release()
+
+    try:
+        future = pool.submit(func, *args)
+    except BaseException:
+        slot.release()
+        raise
+    # The slot is held until the hash ends, even if its caller gave up
+    future.add_done_callback(lambda _: slot.release())
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusy()
+
+
+def hash_password(password):
+    return run(hashpw, password, current_app.config['BCRYPT_LOG_ROUNDS'])
+
+
+def check_password(pw_hash, password):
+    return run(checkpw, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    try:
+        return int(pw_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
@@ -8,13 +8,18 @@ in a database and their relationships.
 
 '''
 from flask_login import UserMixin
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.hybrid import hybrid_property
+import numpy as np
 
 from datetime import datetime
 from enum import Enum
+import math
 import uuid
 
-from app import db, login_manager
+from app import db, login_manager, caching, cure, replicas
 
 
 @login_manager.user_loader
@@ -25,6 +30,7 @@ def load_user(user_id):
 class Table():
 
     @classmethod
+    @replicas.reads
     def get_all(cls):
         return cls.query.all()
 
@@ -40,6 +46,23 @@ class Table():
         db.session.delete(self)
         db.session.commit()
 
+    @classmethod
+    def upsert(cls, session, values, update):
+        '''Inserts a row of `values`, or applies `update` to the row with
+        the same primary key if there is one. On PostgreSQL and SQLite
+        this is one statement, so concurrent writers cannot both insert.
+
+        '''
+        dialect = session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(cls).values(values)
+            session.execute(statement.on_conflict_do_update(index_elements=cls.__table__.primary_key.columns, set_=update))
+            return
+        key = [column == values[column.name] for column in cls.__table__.primary_key.columns]
+        if session.execute(db.update(cls).where(*key).values(update)).rowcount == 0:
+            session.execute(db.insert(cls).values(values))
+
 
 class User(db.Model, UserMixin, Table):
     id = db.Column(db.Integer, primary_key=True)
@@ -63,7 +86,7 @@ class User(db.Model, UserMixin, Table):
 
     @classmethod
     def get_by_email(cls, email):
-        return cls.query.filter_by(email=email).first()
+        return db.session.scalars(db.lambda_stmt(lambda: db.select(cls).where(cls.email == email))).first()
 
 
 class SortByEnum(Enum):
@@ -80,6 +103,8 @@ class UserSettings(db.Model, Table):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     sort_by = db.Column(db.Enum(SortByEnum), nullable=False)
     only_show_active = db.Column(db.Boolean, nullable=False)
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), nullable=True)
+    station = db.relationship('Station')
 
     def __init__(self, sort_by=SortByEnum.start_time, only_show_active=True):
         self.sort_by = sort_by
@@ -92,38 +117,74 @@ class UserSettings(db.Model, Table):
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'sort_by': self.sort_by
+            'sort_by': self.sort_by,
+            'station_id': self.station_id
         }
 
     @classmethod
     def get_by_user_id(cls, user_id):
-        return cls.query.filter_by(user_id=user_id).first()
+        return db.session.scalars(db.lambda_stmt(lambda: db.select(cls).where(cls.user_id == user_id))).first()
 
     def get_sort_by(self):
         return self.sort_by.value
 
 
+# Plug measurements are four 3-vectors stored as one packed array of
+# little-endian doubles, in this order
+GEOMETRY_VECTORS = ('offset', 'vertical_gap', 'horizontal_gap', 'slot_gap')
+GEOMETRY_FIELDS = tuple(f'{vector}_{axis}' for vector in GEOMETRY_VECTORS for axis in 'xyz')
+GEOMETRY_DTYPE = np.dtype('<f8')
+GEOMETRY_SIZE = len(GEOMETRY_FIELDS) * GEOMETRY_DTYPE.itemsize
+
+
+class GeometryField():
+    '''Exposes one component of the packed geometry array as a float
+    attribute, such as `config.offset_x`.
+
+    '''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, config, owner=None):
+        if config is None:
+            return self
+        return float(config.geometry_array.flat[self.index])
+
+    def __set__(self, config, value):
+        geometry = config.geometry_array.copy()
+        geometry.flat[self.index] = value
+        config.geometry_array = geometry
+
+
 class PlugConfig(db.Model, Table):
     # General
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(32), nullable=False, unique=True)
     notes = db.Column(db.String(256), nullable=True)
     cure_profile = db.Column(db.String(32), nullable=False)
+    # Compiled from cure_profile whenever it is set, see `app.cure`
+    cure_schedule = db.Column(db.LargeBinary(cure.MAX_SCHEDULE_SIZE), nullable=False)
     is_archived = db.Column(db.Boolean, nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False)
 
     # Plug measurements
-    offset_x = db.Column(db.Float, nullable=False)
-    offset_y = db.Column(db.Float, nullable=False)
-    offset_z = db.Column(db.Float, nullable=False)
-    vertical_gap_x = db.Column(db.Float, nullable=False)
-    vertical_gap_y = db.Column(db.Float, nullable=False)
-    vertical_gap_z = db.Column(db.Float, nullable=False)
-    horizontal_gap_x = db.Column(db.Float, nullable=False)
-    horizontal_gap_y = db.Column(db.Float, nullable=False)
-    horizontal_gap_z = db.Column(db.Float, nullable=False)
-    slot_gap_x = db.Column(db.Float, nullable=False)
-    slot_gap_y = db.Column(db.Float, nullable=False)
-    slot_gap_z = db.Column(db.Float, nullable=False)
+    geometry = db.Column(db.LargeBinary(GEOMETRY_SIZE), nullable=False)
+    offset_x = GeometryField(0)
+    offset_y = GeometryField(1)
+    offset_z = GeometryField(2)
+    vertical_gap_x = GeometryField(3)
+    vertical_gap_y = GeometryField(4)
+    vertical_gap_z = GeometryField(5)
+    horizontal_gap_x = GeometryField(6)
+    horizontal_gap_y = GeometryField(7)
+    horizontal_gap_z = GeometryField(8)
+    slot_gap_x = GeometryField(9)
+    slot_gap_y = GeometryField(10)
+    slot_gap_z = GeometryField(11)
+
+    # Bump version on every UPDATE
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, name, cure_profile, offset_x, offset_y, offset_z, vertical_gap_x, vertical_gap_y, vertical_gap_z, horizontal_gap_x, horizontal_gap_y, horizontal_gap_z, slot_gap_x, slot_gap_y, slot_gap_z, notes=''):
         # General
@@ -131,38 +192,123 @@ class PlugConfig(db.Model, Table):
         self.cure_profile = cure_profile
 
         # Plug measurements
-        self.offset_x = offset_x
-        self.offset_y = offset_y
-        self.offset_z = offset_z
-        self.vertical_gap_x = vertical_gap_x
-        self.vertical_gap_y = vertical_gap_y
-        self.vertical_gap_z = vertical_gap_z
-        self.horizontal_gap_x = horizontal_gap_x
-        self.horizontal_gap_y = horizontal_gap_y
-        self.horizontal_gap_z = horizontal_gap_z
-        self.slot_gap_x = slot_gap_x
-        self.slot_gap_y = slot_gap_y
-        self.slot_gap_z = slot_gap_z
+        self.geometry_array = [
+            offset_x, offset_y, offset_z,
+            vertical_gap_x, vertical_gap_y, vertical_gap_z,
+            horizontal_gap_x, horizontal_gap_y, horizontal_gap_z,
+            slot_gap_x, slot_gap_y, slot_gap_z
+        ]
 
         # Optional
         self.notes = notes
 
     def __repr__(self):
-        return f'PlugConfig(id={self.id}, name={self.name}, cure_profile={self.cure_profile})'
+        return f'PlugConfig(id={self.id}, name={self.name}, version={self.version}, cure_profile={self.cure_profile})'
 
     def json(self):
         return {
             'id': self.id,
+            'version': self.version,
             'name': self.name,
             'notes': self.notes,
             'cure_profile': self.cure_profile,
             'is_archived': self.is_archived,
-            'offset': [self.offset_x, self.offset_y, self.offset_z],
-            'vertical_gap': [self.vertical_gap_x, self.vertical_gap_y, self.vertical_gap_z],
-            'horizontal_gap': [self.horizontal_gap_x, self.horizontal_gap_y, self.horizontal_gap_z],
-            'slot_gap': [self.slot_gap_x, self.slot_gap_y, self.slot_gap_z]
+            **dict(zip(GEOMETRY_VECTORS, self.geometry_array.tolist()))
         }
 
+    @property
+    def geometry_array(self):
+        '''Read-only (4, 3) view of the offset, vertical gap, horizontal
+        gap and slot gap vectors.
+
+        '''
+        return np.frombuffer(self.geometry, dtype=GEOMETRY_DTYPE).reshape(len(GEOMETRY_VECTORS), 3)
+
+    @geometry_array.setter
+    def geometry_array(self, values):
+        self.geometry = np.asarray(values, dtype=GEOMETRY_DTYPE).reshape(len(GEOMETRY_VECTORS), 3).tobytes()
+
+    def geometry_dict(self):
+        return dict(zip(GEOMETRY_FIELDS, self.geometry_array.ravel().tolist()))
+
+    @db.validates('cure_profile')
+    def compile_cure_profile(self, key, profile):
+        self.cure_schedule = cure.compile_profile(profile)
+        return profile
+
+    @staticmethod
+    def cache_key(id, version):
+        # Every write bumps the version, so stale entries are never looked up
+        return ('config_json', id, version)
+
+    @staticmethod
+    def schedule_cache_key(id, version):
+        return ('cure_schedule', id, version)
+
+    @classmethod
+    def get_cure_schedule(cls, id, version=None):
+        '''Returns the version and packed cure schedule of config `id`, or
+        `None` if it does not exist. A known `version` is looked up in the
+        cache first, which skips the database.
+
+        '''
+        cache = caching.current_cache()
+        if version is not None:
+            schedule = cache.get(cls.schedule_cache_key(id, version))
+            if schedule is not None:
+                return version, schedule
+        row = db.session.query(cls.version, cls.cure_schedule).filter_by(id=id).first()
+        if row is None:
+            return None
+        cache.set(cls.schedule_cache_key(id, row.version), row.cure_schedule)
+        return row.version, row.cure_schedule
+
+    def cached_json(self):
+        key = PlugConfig.cache_key(self.id, self.version)
+        cache = caching.current_cache()
+        cached = cache.get(key)
+        if cached is None:
+            if db.inspect(self).unloaded:
+                db.session.refresh(self)
+            cached = self.json()
+            cache.set(key, cached)
+        return cached
+
+    @classmethod
+    def get_versions(cls):
+        return dict(db.session.query(cls.id, cls.version).order_by(cls.id).all())
+
+    @classmethod
+    def get_changed_json(cls, known_versions=None):
+        '''Returns serialized configs whose version differs from
+        `known_versions`, a mapping of config id to version. Only configs
+        missing from the cache are loaded from the database.
+
+        '''
+        known_versions = known_versions or {}
+        changed = [(id, version) for id, version in cls.get_versions().items() if known_versions.get(id) != version]
+        cache = caching.current_cache()
+        configs = {id: cache.get(cls.cache_key(id, version)) for id, version in changed}
+        missing = [id for id, config in configs.items() if config is None]
+        if missing:
+            for config in cls.query.filter(cls.id.in_(missing)):
+                configs[config.id] = config.cached_json()
+        return [config for config in configs.values() if config is not None]
+
+    @classmethod
+    def get_geometry_arrays(cls, include_archived=False):
+        '''Returns the ids of all configs and their geometry as one
+        contiguous (n, 4, 3) array, without loading ORM objects.
+
+        '''
+        query = db.session.query(cls.id, cls.geometry).order_by(cls.id)
+        if not include_archived:
+            query = query.filter(cls.is_archived.is_(False))
+        rows = query.all()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        geometry = np.frombuffer(b''.join(row[1] for row in rows), dtype=GEOMETRY_DTYPE)
+        return ids, geometry.reshape(len(rows), len(GEOMETRY_VECTORS), 3)
+
     @classmethod
     def get_by_name(cls, name):
         return cls.query.filter_by(name=name).first()
@@ -176,7 +322,37 @@ class PlugConfig(db.Model, Table):
         db.session.commit()
 
 
+class Station(db.Model, Table):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(32), nullable=False, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'Station(id={self.id}, name={self.name})'
+
+    def json(self):
+        return {
+            'id': self.id,
+            'name': self.name
+        }
+
+    @classmethod
+    def get_by_name(cls, name):
+        return cls.query.filter_by(name=name).first()
+
+    @classmethod
+    def query_ordered(cls):
+        return cls.query.order_by(cls.id)
+
+    @staticmethod
+    def version_name(station_id):
+        return f'station_{station_id}'
+
+
 class StatusEnum(Enum):
+    queued = 'queued'
     started = 'started'
     stopped = 'stopped'
     finished = 'finished'
@@ -184,76 +360,216 @@ class StatusEnum(Enum):
 
 
 class PlugJob(db.Model, Table):
+    # At most one started job per station, enforced by a partial unique index
+    __table_args__ = (
+        db.Index('ix_plug_job_station_status', 'station_id', 'status'),
+        db.Index(
+            'uq_plug_job_station_active', 'station_id', unique=True,
+            postgresql_where=db.text("status = 'started'"),
+            sqlite_where=db.text("status = 'started'")
+        ),
+        db.Index('ix_plug_job_queue', 'status', 'priority', 'queued_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    config_id = db.Column(db.Integer, db.ForeignKey('plug_config.id'), nullable=False)
+    config_id = db.Column(db.Integer, db.ForeignKey('plug_config.id'), nullable=False, index=True)
     config = db.relationship('PlugConfig', backref=db.backref('jobs', lazy=True))
-    start_time = db.Column(db.DateTime, nullable=True)
+    # Queued jobs may leave the station unset to run on whichever claims them
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), nullable=True)
+    station = db.relationship('Station', backref=db.backref('jobs', lazy='dynamic'))
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    queued_time = db.Column(db.DateTime, nullable=True)
+    start_time = db.Column(db.DateTime, nullable=True, index=True)
     status = db.Column(db.Enum(StatusEnum), nullable=False)
     notes = db.Column(db.String(256), nullable=True)
     end_time = db.Column(db.DateTime, nullable=True)
     duration = db.Column(db.Float, nullable=True)
 
-    def __init__(self, config_id, start_time, status=StatusEnum.started, notes=''):
+    def __init__(self, config_id, start_time, station_id, status=StatusEnum.started, notes='', priority=0, queued_time=None):
         self.config_id = config_id
         self.start_time = start_time
+        self.station_id = station_id
         self.status = status
         self.notes = notes
+        self.priority = priority
+        self.queued_time = queued_time
 
     def __repr__(self):
-        return f'PlugJob(id={self.id}, config_id={self.config_id}, status={self.status})'
+        return f'PlugJob(id={self.id}, config_id={self.config_id}, station_id={self.station_id}, status={self.status})'
 
     def is_active(self):
         return self.status == StatusEnum.started
 
+    def is_queued(self):
+        return self.status == StatusEnum.queued
+
     @hybrid_property
     def query_is_active(self):
         return self.status == StatusEnum.started
 
-    def json(self):
-        return {
+    def json(self, include_config=True):
+        data = {
             'id': self.id,
             'config_id': self.config_id,
+            'config_version': self.config.version,
+            'station_id': self.station_id,
             'status': self.status.value,
+            'priority': self.priority,
+            'queued_time': self.queued_time.timestamp() if self.queued_time else None,
             'start_time': self.start_time.timestamp() if self.start_time else None,
             'end_time': self.end_time,
             'duration': self.duration,
-            'notes': self.notes,
-            'config': self.config.json()
+            'notes': self.notes
         }
+        if include_config:
+            data['config'] = self.config.cached_json()
+        return data
 
     @classmethod
+    @replicas.reads
     def get_by_config(cls, config_id):
         return cls.query.filter_by(config_id=config_id).all()
 
     @classmethod
-    def query_active(cls):
-        return cls.query.filter_by(status=StatusEnum.started)
+    def query_active(cls, station_id=None):
+        query = cls.query.filter_by(status=StatusEnum.started)
+        if station_id is not None:
+            query = query.filter_by(station_id=station_id)
+        return query
+
+    @classmethod
+    def statement_active(cls, station_id=None):
+        statement = db.lambda_stmt(lambda: db.select(cls).where(cls.status == StatusEnum.started))
+        if station_id is not None:
+            statement += lambda s: s.where(cls.station_id == station_id)
+        return statement
+
+    @classmethod
+    def get_first_active(cls, station_id=None):
+        statement = cls.statement_active(station_id) + (lambda s: s.limit(1))
+        return db.session.scalars(statement).first()
+
+    @classmethod
+    def get_active(cls, station_id=None):
+        return db.session.scalars(cls.statement_active(station_id)).all()
+
+    @classmethod
+    def get_active_with_config_versions(cls, station_id=None):
+        statement = cls.statement_active(station_id) + (lambda s: s.options(db.joinedload(cls.config).load_only(PlugConfig.version)))
+        return db.session.scalars(statement).all()
+
+    @classmethod
+    def paginate_jobs(cls, page, per_page, sort_by, only_show_active=False, station_id=None):
+        '''Returns a page of jobs for the jobs table, sorted by a
+        `SortByEnum` value and optionally filtered to active jobs and to
+        jobs that may run on `station_id`.
+
+        '''
+        statement = db.lambda_stmt(lambda: db.select(cls))
+        count_statement = db.lambda_stmt(lambda: db.select(db.func.count(cls.id)))
+        if sort_by == 'name':
+            statement += lambda s: s.join(cls.config).order_by(PlugConfig.name.desc())
+        else:
+            order = JOB_ORDERS[sort_by]
+            statement += lambda s: s.order_by(order)
+        if only_show_active:
+            statement += lambda s: s.where(cls.status == StatusEnum.started)
+            count_statement += lambda s: s.where(cls.status == StatusEnum.started)
+        if station_id is not None:
+            statement += lambda s: s.where(db.or_(cls.station_id == station_id, cls.station_id.is_(None)))
+            count_statement += lambda s: s.where(db.or_(cls.station_id == station_id, cls.station_id.is_(None)))
+        return StatementPagination(page=page, per_page=per_page, statement=statement, count_statement=count_statement)
+
+    @classmethod
+    def enqueue(cls, config_id, station_id=None, priority=0):
+        job = cls(config_id=config_id, start_time=None, station_id=station_id, status=StatusEnum.queued, priority=priority, queued_time=datetime.now())
+        job.save()
+        return job
+
+    @classmethod
+    def query_queued(cls, station_id=None):
+        query = cls.query.filter_by(status=StatusEnum.queued)
+        if station_id is not None:
+            query = query.filter(db.or_(cls.station_id == station_id, cls.station_id.is_(None)))
+        return query.order_by(cls.priority.desc(), cls.queued_time, cls.id)
 
     @classmethod
-    def get_active(cls):
-        return cls.query_active().all()
+    def get_queued(cls, station_id=None):
+        return cls.query_queued(station_id).all()
+
+    @classmethod
+    def claim_next(cls, station_id, attempts=5):
+        '''Starts the highest priority queued job that may run on
+        `station_id` and returns it, or `None` when the queue is empty or
+        the station already has an active job.
+
+        On PostgreSQL the candidate row is locked with `FOR UPDATE SKIP
+        LOCKED`, so concurrent claimers take different jobs without
+        waiting on each other. Other databases ignore the lock, so the
+        update only applies while the job is still queued, and a claimer
+        that loses the race tries the next job.
+
+        '''
+        for _ in range(attempts):
+            if cls.get_first_active(station_id) is not None:
+                return None
+            job_id = db.session.execute(
+                db.select(cls.id)
+                .where(cls.status == StatusEnum.queued)
+                .where(db.or_(cls.station_id == station_id, cls.station_id.is_(None)))
+                .order_by(cls.priority.desc(), cls.queued_time, cls.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+            try:
+                claimed = db.session.execute(
+                    db.update(cls)
+                    .where(cls.id == job_id, cls.status == StatusEnum.queued)
+                    .values(status=StatusEnum.started, start_time=datetime.now(), station_id=station_id)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                db.session.commit()
+            except IntegrityError:
+                # Another claimer started a job on this station first
+                db.session.rollback()
+                return None
+            if claimed:
+                # Bumped in their own transaction, so claimers only hold
+                # the shared version row for the bump, not the claim
+                DataVersion.bump(db.session, cls.__tablename__)
+                DataVersion.bump(db.session, Station.version_name(station_id))
+                db.session.commit()
+                return cls.query.get(job_id)
+        return None
 
     @classmethod
     def query_inactive(cls):
         return cls.query.filter(cls.status != StatusEnum.started)
 
     @classmethod
+    @replicas.reads
     def get_inactive(cls):
         return cls.query_inactive().all()
 
     @classmethod
+    @replicas.reads
     def get_started(cls):
         return cls.query.filter_by(status=StatusEnum.started).all()
 
     @classmethod
+    @replicas.reads
     def get_stopped(cls):
         return cls.query.filter_by(status=StatusEnum.stopped).all()
 
     @classmethod
+    @replicas.reads
     def get_finished(cls):
         return cls.query.filter_by(status=StatusEnum.finished).all()
 
     @classmethod
+    @replicas.reads
     def get_failed(cls):
         return cls.query.filter_by(status=StatusEnum.failed).all()
 
@@ -261,11 +577,45 @@ class PlugJob(db.Model, Table):
         self.status = StatusEnum.stopped
         self.end()
 
-    def end(self):
+    def cancel(self):
+        self.status = StatusEnum.stopped
         self.end_time = datetime.now()
-        self.duration = (self.end_time - self.start_time).total_seconds()
         db.session.commit()
 
+    def end(self):
+        self.set_ended(datetime.now())
+        db.session.commit()
+
+    def set_ended(self, end_time):
+        self.end_time = end_time
+        self.duration = (self.end_time - self.start_time).total_seconds()
+        if self.status == StatusEnum.finished:
+            DurationStats.record(db.session, self.config_id, self.duration)
+
+
+JOB_ORDERS = {
+    'id': PlugJob.id.desc(),
+    'status': PlugJob.status,
+    'start_time': PlugJob.start_time.desc(),
+    'end_time': PlugJob.end_time.desc(),
+    'duration': PlugJob.duration.desc(),
+}
+
+
+class StatementPagination(Pagination):
+    '''Paginates a lambda statement, with a separate lambda statement
+    counting the rows.
+
+    '''
+
+    def _query_items(self):
+        limit, offset = self.per_page, self._query_offset
+        statement = self._query_args['statement'] + (lambda s: s.limit(limit).offset(offset))
+        return db.session.scalars(statement).all()
+
+    def _query_count(self):
+        return db.session.scalar(self._query_args['count_statement'])
+
 
 class APIKey(db.Model, Table):
     # __table_args__ = (db.UniqueConstraint('user_id', name='user_id'),)
@@ -273,27 +623,192 @@ class APIKey(db.Model, Table):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user = db.relationship('User', backref=db.backref('api_keys', lazy=True))
     key = db.Column(db.String(64), nullable=False, unique=True)
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), nullable=True)
+    station = db.relationship('Station', backref=db.backref('api_keys', lazy=True))
 
-    def __init__(self, name, user_id):
+    def __init__(self, name, user_id, station_id=None):
         self.name = name
         self.user_id = user_id
+        self.station_id = station_id
         self.key = str(uuid.uuid4())
 
     def __repr__(self):
-        return f'APIKey(id={self.id}, name={self.name}, user_id={self.user_id})'
+        return f'APIKey(id={self.id}, name={self.name}, user_id={self.user_id}, station_id={self.station_id})'
 
     def json(self):
         return {
             'id': self.id,
             'name': self.name,
             'key': self.key,
-            'user_id': self.user_id
+            'user_id': self.user_id,
+            'station_id': self.station_id
         }
 
     @classmethod
     def get_by_key(cls, key):
-        return cls.query.filter_by(key=key).first()
+        return db.session.scalars(db.lambda_stmt(lambda: db.select(cls).where(cls.key == key))).first()
 
     @classmethod
     def get_by_user(cls, user_id):
         return cls.query.filter_by(user_id=user_id).all()
+
+
+class SyncEvent(db.Model, Table):
+    '''A job status change uploaded by a controller. The id is the
+    controller's sync position, and the idempotency key makes a retried
+    upload of the same event a no-op.
+
+    '''
+    __table_args__ = (db.UniqueConstraint('api_key_id', 'idempotency_key', name='uq_sync_event_key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_key.id', ondelete='CASCADE'), nullable=False)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('plug_job.id', ondelete='SET NULL'), nullable=True)
+    status = db.Column(db.String(16), nullable=False)
+    device_time = db.Column(db.DateTime, nullable=True)
+    received_time = db.Column(db.DateTime, nullable=False, index=True)
+    result = db.Column(db.String(16), nullable=False)
+    message = db.Column(db.String(128), nullable=True)
+
+    def __init__(self, api_key_id, idempotency_key, job_id, status, device_time, result, message=None):
+        self.api_key_id = api_key_id
+        self.idempotency_key = idempotency_key
+        self.job_id = job_id
+        self.status = status
+        self.device_time = device_time
+        self.received_time = datetime.now()
+        self.result = result
+        self.message = message
+
+    def __repr__(self):
+        return f'SyncEvent(id={self.id}, api_key_id={self.api_key_id}, job_id={self.job_id}, status={self.status}, result={self.result})'
+
+    def json(self):
+        data = {'key': self.idempotency_key, 'result': self.result}
+        if self.message:
+            data['message'] = self.message
+        return data
+
+    @classmethod
+    def get_by_keys(cls, api_key_id, keys):
+        return {event.idempotency_key: event for event in cls.query.filter(cls.api_key_id == api_key_id, cls.idempotency_key.in_(keys))}
+
+    @classmethod
+    def get_after(cls, api_key_id, cursor):
+        return cls.query.filter(cls.api_key_id == api_key_id, cls.id > cursor).order_by(cls.id).all()
+
+    @classmethod
+    def get_cursor(cls, api_key_id):
+        return db.session.query(db.func.max(cls.id)).filter(cls.api_key_id == api_key_id).scalar() or 0
+
+
+class DurationStats(db.Model, Table):
+    '''Running count, mean and sum of squared differences from the mean
+    of a config's finished job durations, updated one job at a time with
+    Welford's algorithm.
+
+    '''
+    config_id = db.Column(db.Integer, db.ForeignKey('plug_config.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0)
+    m2 = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, config_id, count=0, mean=0.0, m2=0.0):
+        self.config_id = config_id
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def __repr__(self):
+        return f'DurationStats(config_id={self.config_id}, count={self.count}, mean={self.mean}, stdev={self.stdev})'
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    @classmethod
+    def record(cls, session, config_id, duration):
+        '''Adds a finished job's duration. The upsert is one statement
+        computed from the stored values, so concurrent workers cannot
+        lose each other's updates.
+
+        '''
+        delta = duration - cls.mean
+        cls.upsert(session, {'config_id': config_id, 'count': 1, 'mean': duration, 'm2': 0.0}, {
+            'count': cls.count + 1,
+            'mean': cls.mean + delta / (cls.count + 1),
+            'm2': cls.m2 + delta * (delta - delta / (cls.count + 1)),
+        })
+
+    @classmethod
+    def get_by_configs(cls, config_ids):
+        if not config_ids:
+            return {}
+        return {stats.config_id: stats for stats in cls.query.filter(cls.config_id.in_(config_ids))}
+
+    @classmethod
+    def recompute(cls):
+        '''Returns `(count, mean, m2)` per config id computed from every
+        finished job.
+
+        '''
+        rows = db.session.query(PlugJob.config_id, PlugJob.duration).filter(
+            PlugJob.status == StatusEnum.finished, PlugJob.duration.isnot(None)
+        ).all()
+        config_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        durations = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        ids, index, counts = np.unique(config_ids, return_inverse=True, return_counts=True)
+        means = np.bincount(index, weights=durations) / counts if len(rows) else np.zeros(0)
+        m2s = np.bincount(index, weights=(durations - means[index]) ** 2) if len(rows) else np.zeros(0)
+        return {int(id): (int(count), float(mean), float(m2)) for id, count, mean, m2 in zip(ids, counts, means, m2s)}
+
+    @classmethod
+    def rebuild(cls):
+        '''Replaces every config's statistics with a full recompute. The
+        caller commits.
+
+        '''
+        cls.query.delete()
+        db.session.add_all(cls(id, *stats) for id, stats in cls.recompute().items())
+
+
+class DataVersion(db.Model, Table):
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+    def __repr__(self):
+        return f'DataVersion(name={self.name}, version={self.version})'
+
+    @classmethod
+    def get_versions(cls):
+        return dict(db.session.query(cls.name, cls.version).all())
+
+    @classmethod
+    def get_version(cls, name):
+        return db.session.query(cls.version).filter_by(name=name).scalar() or 0
+
+    @classmethod
+    def bump(cls, session, name):
+        cls.upsert(session, {'name': name, 'version': 1}, {'version': cls.version + 1})
+
+
+# Tables whose writes bump their DataVersion, invalidating anything
+# cached from them. Job writes also bump their station's version, which
+# is the change feed its controller polls.
+VERSIONED_TABLES = (PlugJob, PlugConfig, Station)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def bump_data_versions(session, flush_context):
+    changed = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, VERSIONED_TABLES):
+            changed.add(obj.__tablename__)
+        if isinstance(obj, PlugJob) and obj.station_id is not None:
+            changed.add(Station.version_name(obj.station_id))
+    for name in sorted(changed):
+        DataVersion.bump(session, name)
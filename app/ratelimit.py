@@ -0,0 +1,186 @@
+'''Module for rate limiting and admission control of API requests.
+
+Each API key gets a token bucket per route. A request takes one token,
+and tokens refill at `rate` per second up to `burst`. Expensive routes
+also get a cap on how many requests run at once, across all keys, so a
+runaway script cannot occupy every worker. Rejected requests get a 429
+with `Retry-After` instead of queuing.
+
+`RATE_LIMIT_BACKEND` selects where the state lives:
+
+* ``memory`` (default) keeps it in the worker process. Each worker
+  enforces the limits on its own.
+* ``sqlite`` keeps it in the SQLite file at `RATE_LIMIT_SQLITE_PATH`,
+  shared by every worker on the host. Concurrency slots are leases that
+  expire after `RATE_LIMIT_LEASE_SECONDS`, so a crashed worker cannot
+  hold one forever.
+
+Other backends only need `take`, `acquire` and `release`.
+
+'''
+from flask import current_app, request
+
+from collections import namedtuple
+import contextlib
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from app.sqlitefile import SQLiteFile
+
+
+Limit = namedtuple('Limit', ['rate', 'burst', 'concurrency'])
+
+# Endpoints with their own limits, read from the `<ENDPOINT>_RATE`,
+# `_BURST` and `_CONCURRENCY` config, such as `API_JOBS_RATE`. Routes not
+# listed use the `API_RATE` and `API_BURST` defaults without a
+# concurrency cap.
+ROUTE_LIMITS = ('api_jobs', 'api_insights')
+
+
+class MemoryBackend():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.running = {}
+
+    def take(self, key, rate, burst, now):
+        '''Takes a token from the bucket `key`. Returns 0 on success, or
+        the seconds until a token is available.
+
+        '''
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+    def acquire(self, key, limit, now):
+        '''Takes one of `limit` slots for `key`. Returns a token to pass
+        to `release`, or `None` when every slot is taken.
+
+        '''
+        with self.lock:
+            running = self.running.get(key, 0)
+            if running >= limit:
+                return None
+            self.running[key] = running + 1
+        return key
+
+    def release(self, key, token):
+        with self.lock:
+            self.running[key] -= 1
+
+
+class SQLiteBackend(SQLiteFile):
+
+    def __init__(self, path, lease_seconds):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)',
+            'CREATE TABLE IF NOT EXISTS slot (token TEXT PRIMARY KEY, key TEXT, expires REAL)',
+            'CREATE INDEX IF NOT EXISTS ix_slot_key ON slot (key, expires)',
+        ))
+        self.lease_seconds = lease_seconds
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def take(self, key, rate, burst, now):
+        with self.transaction() as connection:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens = min(burst, tokens + max(0, now - updated) * rate)
+            allowed = tokens >= 1
+            connection.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens - 1 if allowed else tokens, now)
+            )
+        return 0 if allowed else (1 - tokens) / rate
+
+    def acquire(self, key, limit, now):
+        token = uuid.uuid4().hex
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM slot WHERE key = ? AND expires < ?', (key, now))
+            running = connection.execute('SELECT COUNT(*) FROM slot WHERE key = ?', (key,)).fetchone()[0]
+            if running >= limit:
+                return None
+            connection.execute('INSERT INTO slot (token, key, expires) VALUES (?, ?, ?)', (token, key, now + self.lease_seconds))
+        return token
+
+    def release(self, key, token):
+        self.connection.execute('DELETE FROM slot WHERE token = ?', (token,))
+
+
+backend = None
+backend_lock = threading.Lock()
+
+
+def get_backend():
+    global backend
+    with backend_lock:
+        if backend is None:
+            if current_app.config['RATE_LIMIT_BACKEND'] == 'sqlite':
+                path = current_app.config['RATE_LIMIT_SQLITE_PATH'] or os.path.join(tempfile.gettempdir(), 'rate_limits.db')
+                backend = SQLiteBackend(path, current_app.config['RATE_LIMIT_LEASE_SECONDS'])
+            else:
+                backend = MemoryBackend()
+    return backend
+
+
+def route_limit(endpoint):
+    config = current_app.config
+    if endpoint in ROUTE_LIMITS:
+        prefix = endpoint.upper()
+        return Limit(config[f'{prefix}_RATE'], config[f'{prefix}_BURST'], config[f'{prefix}_CONCURRENCY'])
+    return Limit(config['API_RATE'], config['API_BURST'], None)
+
+
+def too_many_requests(message, retry_after):
+    return {'response': 429, 'message': message}, 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+@contextlib.contextmanager
+def admit(api_key):
+    '''Admits a request made with `api_key` to the current route. Yields
+    `None` when it may run, or a 429 response to return instead.
+
+    '''
+    if not current_app.config['RATE_LIMIT_ENABLED']:
+        yield None
+        return
+
+    limits = get_backend()
+    limit = route_limit(request.endpoint)
+    now = time.time()
+    retry_after = limits.take(f'{api_key.id}:{request.endpoint}', limit.rate, limit.burst, now)
+    if retry_after:
+        yield too_many_requests('Rate limit exceeded for this API key', retry_after)
+        return
+
+    if limit.concurrency is None:
+        yield None
+        return
+
+    token = limits.acquire(request.endpoint, limit.concurrency, now)
+    if token is None:
+        yield too_many_requests('Too many requests are running for this route', 1)
+        return
+    try:
+        yield None
+    finally:
+        limits.release(request.endpoint, token)
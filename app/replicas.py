@@ -0,0 +1,129 @@
+'''Module for routing read-only queries to database replicas.
+
+Replica URLs are read from `REPLICA_DATABASE_URLS` (comma separated) and
+registered as Flask-SQLAlchemy binds. Code wrapped in `reads`, either a
+route or a model helper, sends its queries to a replica. Everything else,
+and every flush, uses the primary.
+
+A replica is skipped, falling back to the primary, when:
+
+* the session has already written, so the request reads its own writes,
+* the browser session wrote within the last `REPLICA_STICKY_SECONDS`, so
+  the page after a form submit is not stale,
+* the replica lags by more than `REPLICA_MAX_LAG` seconds, checked at
+  most every `REPLICA_LAG_CHECK_INTERVAL` seconds, or cannot be reached.
+
+'''
+from flask import current_app, has_request_context, session
+import flask_sqlalchemy.session
+import sqlalchemy as sa
+
+import contextlib
+import functools
+import random
+import threading
+import time
+
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+lag_lock = threading.Lock()
+lag_checks = {}
+
+
+def replica_binds(urls):
+    return {f'{REPLICA_BIND_PREFIX}{i}': url for i, url in enumerate(url.strip() for url in urls.split(',') if url.strip())}
+
+
+def replica_keys(engines):
+    return [key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def measure_lag(engine):
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as connection:
+        return float(connection.execute(sa.text(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() IS NULL '
+            'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+        )).scalar() or 0.0)
+
+
+def replica_lag(key, engine):
+    '''Returns the replica's lag in seconds, cached between checks. A
+    replica that cannot be reached reports infinite lag.
+
+    '''
+    now = time.monotonic()
+    with lag_lock:
+        checked_at, lag = lag_checks.get(key, (None, None))
+        if checked_at is not None and now - checked_at < current_app.config['REPLICA_LAG_CHECK_INTERVAL']:
+            return lag
+    try:
+        lag = measure_lag(engine)
+    except sa.exc.SQLAlchemyError:
+        lag = float('inf')
+    with lag_lock:
+        lag_checks[key] = (now, lag)
+    return lag
+
+
+def sticky_to_primary():
+    return has_request_context() and session.get('primary_until', 0) > time.time()
+
+
+class RoutingSession(flask_sqlalchemy.session.Session):
+
+    def choose_replica(self):
+        if self.info.get('wrote') or sticky_to_primary():
+            return None
+        engines = self._db.engines
+        keys = replica_keys(engines)
+        random.shuffle(keys)
+        for key in keys:
+            if replica_lag(key, engines[key]) <= current_app.config['REPLICA_MAX_LAG']:
+                return engines[key]
+        return None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('use_replica') and not self._flushing:
+            if 'replica' not in self.info:
+                self.info['replica'] = self.choose_replica()
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def mark_wrote(db_session, flush_context):
+    db_session.info['wrote'] = True
+    db_session.info.pop('replica', None)
+    if has_request_context() and replica_keys(db_session._db.engines):
+        session['primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def forget_replica(db_session):
+    db_session.info.pop('replica', None)
+
+
+@contextlib.contextmanager
+def replica_session():
+    db_session = current_app.extensions['sqlalchemy'].session()
+    previous = db_session.info.get('use_replica', False)
+    db_session.info['use_replica'] = True
+    try:
+        yield db_session
+    finally:
+        db_session.info['use_replica'] = previous
+
+
+def reads(func):
+    '''Sends the queries made by `func` to a replica when one is usable.'''
+    @functools.wraps(func)
+    def decorator(*args, **kwargs):
+        with replica_session():
+            return func(*args, **kwargs)
+    return decorator
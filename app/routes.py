@@ -1,106 +1,181 @@
 '''Module for website routing and rendering.
 
 Maps the webpage URLs to specific functions which handle page logic and
-rendering.
+rendering. Views are recorded with `route` and added to an app by
+`register_routes`, which `create_app` calls.
 
 '''
-from flask import render_template, flash, redirect, url_for, Response, request
+from flask import render_template, flash, redirect, url_for, Response, request, g
 from flask_login import login_required, login_user, logout_user, current_user
 import matplotlib
 import matplotlib.pyplot as plt
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.figure import Figure
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import io
 from statistics import stdev, mean, median
 import os
 
-from app import app, db, bcrypt, models, forms
+from app import db, models, forms, cure, hashing, analytics, estimates, fragments, replicas, search, sync
 from . import security
 
 
-@app.route('/', methods=['GET', 'POST'])
+ROUTES = []
+
+
+def route(rule, **options):
+    '''Records a view for `register_routes`, like `Flask.route`.'''
+    def decorator(func):
+        ROUTES.append((rule, func, options))
+        return func
+    return decorator
+
+
+def register_routes(app):
+    for rule, func, options in ROUTES:
+        app.add_url_rule(rule, view_func=func, **options)
+
+
+@route('/', methods=['GET', 'POST'])
 def jobs():
     if not current_user.is_authenticated:
         form = forms.UserSignInForm()
         if form.validate_on_submit():
             user = models.User.get_by_email(form.email.data)
-            if user is None or not bcrypt.check_password_hash(user.password, form.password.data):
-                flash('Invalid email or password', 'danger')
+            try:
+                if user is None or not hashing.check_password(user.password, form.password.data):
+                    flash('Invalid email or password', 'danger')
+                    return redirect(url_for('jobs'))
+            except hashing.HashingBusy:
+                flash('Too many sign-ins at once, please try again', 'danger')
                 return redirect(url_for('jobs'))
+            if hashing.needs_rehash(user.password):
+                try:
+                    user.password = hashing.hash_password(form.password.data)
+                    db.session.commit()
+                except hashing.HashingBusy:
+                    # The password is correct, so upgrade the hash on a later sign-in
+                    pass
             login_user(user)
             return redirect(url_for('jobs'))
         return render_template('base.html', form=form)
     else:
         page = request.args.get('page', 1, type=int)
+        settings = current_user.settings
+        sort_by = settings.get_sort_by()
 
-        sort_by = current_user.settings.get_sort_by()
-        if sort_by == 'id':
-            jobs = models.PlugJob.query.order_by(models.PlugJob.id.desc())
-        elif sort_by == 'name':
-            jobs = models.PlugJob.query.join(models.PlugConfig).order_by(models.PlugConfig.name.desc())
-        elif sort_by == 'status':
-            jobs = models.PlugJob.query.order_by(models.PlugJob.status)
-        elif sort_by == 'start_time':
-            jobs = models.PlugJob.query.order_by(models.PlugJob.start_time.desc())
-        elif sort_by == 'end_time':
-            jobs = models.PlugJob.query.order_by(models.PlugJob.end_time.desc())
-        elif sort_by == 'duration':
-            jobs = models.PlugJob.query.order_by(models.PlugJob.duration.desc())
+        def query_jobs():
+            return models.PlugJob.paginate_jobs(page, 10, sort_by, settings.only_show_active, settings.station_id)
+
+        def query_configs():
+            return models.PlugConfig.query.order_by(models.PlugConfig.name)
 
+        overrunning = estimates.overrunning_ids(settings.station_id)
+        jobs_table = fragments.jobs_table(page, settings, query_jobs, overrunning)
+        config_options = fragments.config_options(query_configs)
+        station_options = fragments.station_options(settings.station_id, models.Station.query_ordered)
         sort_by = sort_by.replace('_', ' ')
         sort_by = ' '.join([word.capitalize() for word in sort_by.split(' ')])
+        station = settings.station.name if settings.station else 'All'
+        return render_template('pages/jobs.html', title='Jobs', page='jobs', config_options=config_options, station_options=station_options, jobs_table=jobs_table, sort_by=sort_by, station=station)
 
-        if current_user.settings.only_show_active:
-            jobs = jobs.filter(models.PlugJob.query_is_active)
 
-        jobs = jobs.paginate(page=page, per_page=10)
-        configs = models.PlugConfig.query.order_by(models.PlugConfig.name)
-        return render_template('pages/jobs.html', title='Jobs', page='jobs', configs=configs, jobs=jobs, sort_by=sort_by)
+@route('/search')
+@login_required
+@replicas.reads
+def search_jobs():
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d')
 
+    page = request.args.get('page', 1, type=int)
+    query = request.args.get('q', '')
+    statuses = [models.StatusEnum[status] for status in request.args.getlist('status') if status in models.StatusEnum.__members__]
+    start = request.args.get('start', type=parse_date)
+    end = request.args.get('end', type=parse_date)
+    jobs = search.search_jobs(query, page, 10, statuses, start, end + timedelta(days=1) if end else None)
+    page_args = {
+        'q': query,
+        'status': [status.value for status in statuses],
+        'start': start.strftime('%Y-%m-%d') if start else '',
+        'end': end.strftime('%Y-%m-%d') if end else '',
+    }
+    jobs_table = render_template('tables/jobs.html', jobs=jobs, estimates=estimates.for_jobs(jobs.items), page_args=page_args)
+    return render_template('pages/search.html', title='Search', page='search', jobs_table=jobs_table, statuses=list(models.StatusEnum), **page_args)
 
-@app.route('/job/<int:job_id>', methods=['GET', 'POST'])
+
+@route('/job/<int:job_id>', methods=['GET', 'POST'])
 @login_required
 def view_job(job_id):
     job = models.PlugJob.get_by_id(job_id)
-    return render_template('pages/view_job.html', title=f'Job #{job.id}', page='jobs', job=job, config=job.config)
+    config_table = fragments.config_table(job.config)
+    return render_template('pages/view_job.html', title=f'Job #{job.id}', page='jobs', job=job, config=job.config, config_table=config_table)
 
 
-@app.route('/add-job-notes/<int:job_id>', methods=['GET', 'POST'])
+@route('/add-job-notes/<int:job_id>', methods=['GET', 'POST'])
 @login_required
 def edit_job(job_id):
     job = models.PlugJob.get_by_id(job_id)
     form = forms.PlugJobForm()
     if form.validate_on_submit():
         job.notes = form.notes.data
+        search.index_job(job)
         db.session.commit()
         flash(f'Updated {job.id}!', 'success')
         return redirect(url_for('jobs'))
     else:
         form.notes.data = job.notes
-    return render_template('pages/edit_job.html', title=f'Edit Job #{job.id}', page='jobs', form=form, job=job, config=job.config)
+    config_table = fragments.config_table(job.config)
+    return render_template('pages/edit_job.html', title=f'Edit Job #{job.id}', page='jobs', form=form, job=job, config=job.config, config_table=config_table)
 
 
-@app.route('/start-job', methods=['GET', 'POST'])
+@route('/start-job', methods=['GET', 'POST'])
 @login_required
 def start_job():
     config_id = request.form.get('config_select')
     config = models.PlugConfig.get_by_id(config_id)
-    active_jobs = models.PlugJob.get_active()
-    if active_jobs:
-        flash(f'A job for {active_jobs[0].config.name} is active!', 'danger')
+    station = models.Station.get_by_id(request.form.get('station_select', type=int))
+    if station is None:
+        flash('Please select a station!', 'danger')
+        return redirect(url_for('jobs'))
+    active_job = models.PlugJob.get_first_active(station.id)
+    if active_job:
+        flash(f'A job for {active_job.config.name} is active on {station.name}!', 'danger')
         return redirect(url_for('jobs'))
-    job = models.PlugJob(config_id=config_id, start_time=datetime.now())
-    job.save()
-    flash(f'Started job for {config.name}!', 'success')
+    job = models.PlugJob(config_id=config_id, start_time=datetime.now(), station_id=station.id)
+    try:
+        job.save()
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'A job is already active on {station.name}!', 'danger')
+        return redirect(url_for('jobs'))
+    flash(f'Started job for {config.name} on {station.name}!', 'success')
     return redirect(url_for('jobs'))
 
 
-@app.route('/stop-job/<int:job_id>', methods=['GET', 'POST'])
+@route('/queue-job', methods=['GET', 'POST'])
+@login_required
+def queue_job():
+    config = models.PlugConfig.get_by_id(request.form.get('config_select', type=int))
+    station = models.Station.get_by_id(request.form.get('station_select', type=int))
+    if config is None or station is None:
+        flash('Please select a config and a station!', 'danger')
+        return redirect(url_for('jobs'))
+    models.PlugJob.enqueue(config.id, station.id, priority=request.form.get('priority', 0, type=int))
+    flash(f'Queued job for {config.name} on {station.name}!', 'success')
+    return redirect(url_for('jobs'))
+
+
+@route('/stop-job/<int:job_id>', methods=['GET', 'POST'])
 @login_required
 def stop_job(job_id):
     job = models.PlugJob.get_by_id(job_id)
+    if job.is_queued():
+        job.cancel()
+        flash(f'Cancelled queued job for {job.config.name}!', 'success')
+        return redirect(url_for('jobs'))
     if not job.is_active():
         flash(f'Job for {job.config.name} already stopped!', 'danger')
         return redirect(url_for('jobs'))
@@ -109,17 +184,17 @@ def stop_job(job_id):
     return redirect(url_for('jobs'))
 
 
-@app.route('/stop-all-jobs', methods=['GET', 'POST'])
+@route('/stop-all-jobs', methods=['GET', 'POST'])
 @login_required
 def stop_all_jobs():
-    jobs = models.PlugJob.get_active()
+    jobs = models.PlugJob.get_active(current_user.settings.station_id)
     for job in jobs:
         job.stop()
     flash(f'Stopped all jobs!', 'success')
     return redirect(url_for('jobs'))
 
 
-@app.route('/next-job-sort')
+@route('/next-job-sort')
 @login_required
 def next_job_sort():
     def get_next_sort_by(sort_by):
@@ -142,7 +217,18 @@ def next_job_sort():
     return redirect(url_for('jobs'))
 
 
-@app.route('/toggle-only-show-active')
+@route('/next-station')
+@login_required
+def next_station():
+    station_ids = [None] + [station.id for station in models.Station.query_ordered()]
+    settings = current_user.settings
+    index = station_ids.index(settings.station_id) if settings.station_id in station_ids else 0
+    settings.station_id = station_ids[(index + 1) % len(station_ids)]
+    db.session.commit()
+    return redirect(url_for('jobs'))
+
+
+@route('/toggle-only-show-active')
 @login_required
 def toggle_only_show_active():
     current_user.settings.only_show_active = not current_user.settings.only_show_active
@@ -150,40 +236,43 @@ def toggle_only_show_active():
     return redirect(url_for('jobs'))
 
 
-@app.route('/configs', methods=['GET', 'POST'])
+@route('/configs', methods=['GET', 'POST'])
 @login_required
 def configs():
     page = request.args.get('page', 1, type=int)
     form = forms.PlugConfigForm()
     if form.validate_on_submit():
         config = create_config(form)
+        search.index_config(config)
         config.save()
         flash(f'Added {config.name}!', 'success')
         return redirect(url_for('configs'))
-    configs = models.PlugConfig.query_not_archived().paginate(page=page, per_page=5)
-    return render_template('pages/configs.html', title='Configs', page='configs', form=form, configs=configs)
+    configs_table = fragments.configs_table(page, lambda: models.PlugConfig.query_not_archived().paginate(page=page, per_page=5))
+    return render_template('pages/configs.html', title='Configs', page='configs', form=form, configs_table=configs_table)
 
 
-@app.route('/create-config/', methods=['GET', 'POST'])
+@route('/create-config/', methods=['GET', 'POST'])
 @login_required
 def create_config():
     form = forms.PlugConfigForm()
     if form.validate_on_submit():
         config = create_config(form)
+        search.index_config(config)
         config.save()
         flash(f'Added {config.name}!', 'success')
         return redirect(url_for('configs'))
     return render_template('pages/create_config.html', title=f'Create Config', page='configs', form=form)
 
 
-@app.route('/config/<int:config_id>', methods=['GET', 'POST'])
+@route('/config/<int:config_id>', methods=['GET', 'POST'])
 @login_required
 def view_config(config_id):
     config = models.PlugConfig.get_by_id(config_id)
-    return render_template('pages/view_config.html', title=f'{config.name}', page='configs', config=config)
+    config_table = fragments.config_table(config)
+    return render_template('pages/view_config.html', title=f'{config.name}', page='configs', config=config, config_table=config_table)
 
 
-@app.route('/edit-config/<int:config_id>', methods=['GET', 'POST'])
+@route('/edit-config/<int:config_id>', methods=['GET', 'POST'])
 @login_required
 def edit_config(config_id):
     config = models.PlugConfig.get_by_id(config_id)
@@ -201,42 +290,27 @@ def edit_config(config_id):
 
         config.name = form.name.data
         config.cure_profile = form.cure_profile.data
-        config.offset_x = form.offset_x.data
-        config.offset_y = form.offset_y.data
-        config.offset_z = form.offset_z.data
-        config.vertical_gap_x = form.vertical_gap_x.data
-        config.vertical_gap_y = form.vertical_gap_y.data
-        config.vertical_gap_z = form.vertical_gap_z.data
-        config.horizontal_gap_x = form.horizontal_gap_x.data
-        config.horizontal_gap_y = form.horizontal_gap_y.data
-        config.horizontal_gap_z = form.horizontal_gap_z.data
-        config.slot_gap_x = form.slot_gap_x.data
-        config.slot_gap_y = form.slot_gap_y.data
-        config.slot_gap_z = form.slot_gap_z.data
+        config.geometry_array = [getattr(form, field).data for field in models.GEOMETRY_FIELDS]
         config.notes = form.notes.data
-        db.session.commit()
+        search.index_config(config)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash('The config changed while you were editing it! Please reload it and try again.', 'danger')
+            return redirect(url_for('edit_config', config_id=config_id))
         flash(f'Updated {config.name}!', 'success')
         return redirect(url_for('configs'))
     else:
         form.name.data = config.name
         form.cure_profile.data = config.cure_profile
-        form.offset_x.data = config.offset_x
-        form.offset_y.data = config.offset_y
-        form.offset_z.data = config.offset_z
-        form.vertical_gap_x.data = config.vertical_gap_x
-        form.vertical_gap_y.data = config.vertical_gap_y
-        form.vertical_gap_z.data = config.vertical_gap_z
-        form.horizontal_gap_x.data = config.horizontal_gap_x
-        form.horizontal_gap_y.data = config.horizontal_gap_y
-        form.horizontal_gap_z.data = config.horizontal_gap_z
-        form.slot_gap_x.data = config.slot_gap_x
-        form.slot_gap_y.data = config.slot_gap_y
-        form.slot_gap_z.data = config.slot_gap_z
+        for field, value in config.geometry_dict().items():
+            getattr(form, field).data = value
         form.notes.data = config.notes
     return render_template('pages/edit_config.html', title=f'Edit {config.name}', page='configs', form=form, config=config)
 
 
-@app.route('/copy-config/<int:config_id>', methods=['GET', 'POST'])
+@route('/copy-config/<int:config_id>', methods=['GET', 'POST'])
 @login_required
 def copy_config(config_id):
     config = models.PlugConfig.get_by_id(config_id)
@@ -244,39 +318,39 @@ def copy_config(config_id):
         flash(f'Copy of {config.name} already exists! Please rename it first.', 'danger')
         return redirect(url_for('configs'))
 
-    new_config = models.PlugConfig(
-        name=f'{config.name} (copy)',
-        cure_profile=config.cure_profile,
-        offset_x=config.offset_x,
-        offset_y=config.offset_y,
-        offset_z=config.offset_z,
-        vertical_gap_x=config.vertical_gap_x,
-        vertical_gap_y=config.vertical_gap_y,
-        vertical_gap_z=config.vertical_gap_z,
-        horizontal_gap_x=config.horizontal_gap_x,
-        horizontal_gap_y=config.horizontal_gap_y,
-        horizontal_gap_z=config.horizontal_gap_z,
-        slot_gap_x=config.slot_gap_x,
-        slot_gap_y=config.slot_gap_y,
-        slot_gap_z=config.slot_gap_z,
-        notes=config.notes
-    )
+    try:
+        new_config = models.PlugConfig(
+            name=f'{config.name} (copy)',
+            cure_profile=config.cure_profile,
+            **config.geometry_dict(),
+            notes=config.notes
+        )
+    except cure.InvalidProfile as e:
+        flash(f'Cannot copy {config.name}: {e}. Please edit its cure profile first.', 'danger')
+        return redirect(url_for('configs'))
+    search.index_config(new_config)
     new_config.save()
     flash(f'Added {new_config.name}!', 'success')
     return redirect(url_for('configs'))
 
 
-@app.route('/archive-config/<int:config_id>', methods=['GET', 'POST'])
+@route('/archive-config/<int:config_id>', methods=['GET', 'POST'])
 @login_required
 def archive_config(config_id):
     config = models.PlugConfig.get_by_id(config_id)
-    config.archive()
+    try:
+        config.archive()
+    except StaleDataError:
+        db.session.rollback()
+        flash('The config changed while you were archiving it! Please reload it and try again.', 'danger')
+        return redirect(url_for('configs'))
     flash(f'Archived {config.name}!', 'success')
     return redirect(url_for('configs'))
 
 
-@app.route('/insights')
+@route('/insights')
 @login_required
+@replicas.reads
 def insights():
     def calc_total_duration(jobs):
         return "{:.2f}".format(sum(job.duration for job in jobs if job.duration is not None))
@@ -359,7 +433,7 @@ def insights():
     return render_template('pages/insights.html', title='Insights', page='insights', analytics=analytics)
 
 
-@app.route('/account', methods=['GET', 'POST'])
+@route('/account', methods=['GET', 'POST'])
 @login_required
 def account():
     email_form = forms.UserEmailForm()
@@ -373,100 +447,195 @@ def account():
 
     password_form = forms.UserPasswordForm()
     if password_form.validate_on_submit():
-        current_user.password = bcrypt.generate_password_hash(password_form.password.data).decode('utf-8')
+        try:
+            current_user.password = hashing.hash_password(password_form.password.data)
+        except hashing.HashingBusy:
+            flash('The server is busy, please try again', 'danger')
+            return redirect(url_for('account'))
         db.session.commit()
         flash('Your password was updated!', 'success')
         return redirect(url_for('account'))
 
-    return render_template('pages/account.html', title='Account', page='account', email_form=email_form, password_form=password_form)
+    stations = models.Station.query_ordered().all()
+    return render_template('pages/account.html', title='Account', page='account', email_form=email_form, password_form=password_form, stations=stations)
 
 
-@app.route('/docs')
+@route('/docs')
 @login_required
 def docs():
     app_url = os.environ.get('APP_URL', 'http://localhost:5000')
     return render_template('pages/docs.html', title='Docs', page='docs', app_url=app_url)
 
 
-@app.route('/about')
+@route('/about')
 @login_required
 def about():
     return render_template('pages/about.html', title='About', page='about')
 
 
-@app.route('/api/key', methods=['GET', 'POST'])
+@route('/api/key', methods=['GET', 'POST'])
 @login_required
 def api_key():
-    key = models.APIKey.query.filter_by(user_id=current_user.id).first()
+    station_id = request.form.get('station_select', type=int)
+    key = models.APIKey.query.filter_by(user_id=current_user.id, station_id=station_id).first()
     if key:
         key.delete()
-    key = models.APIKey(name='', user_id=current_user.id)
+    key = models.APIKey(name='', user_id=current_user.id, station_id=station_id)
     key.save()
     flash(f'Generated a new API key: {key.key}! Save this someplace safe!', 'success')
     return redirect(url_for('account'))
 
 
-@app.route('/api/active', methods=['GET', 'POST'])
+@route('/api/active', methods=['GET', 'POST'])
 @security.api_key_required
 def api_active():
+    data = request.get_json(force=True)
+    station_id = g.api_key.station_id or data.get('station_id')
     if request.method == 'POST':
-        data = request.get_json(force=True)
         job = models.PlugJob.query.filter_by(id=data['id']).first()
-        if job:
+        if job and station_id is not None and job.station_id not in (station_id, None):
+            return {'response': 403, 'message': 'The job belongs to another station'}, 403
+        if job and job.is_queued():
+            if data['status'] == 'stopped':
+                job.cancel()
+        elif job and job.is_active():
             if data['status'] == 'finished' or data['status'] == 'failed' or data['status'] == 'stopped':
-                job.end()
                 job.status = getattr(models.StatusEnum, data['status'])
-                db.session.commit()
+                job.end()
         return {'response': 200}, 200
     elif request.method == 'GET':
-        active = [job.json() for job in models.PlugJob.get_active()]
-        return {'response': 200, 'data': active}, 200
+        version_name = models.Station.version_name(station_id) if station_id is not None else 'plug_job'
+        version = models.DataVersion.get_version(version_name)
+        if data.get('since') == version:
+            return {'response': 200, 'version': version, 'changed': False}, 200
+        active = active_jobs_json(station_id, data.get('include_config', True))
+        return {'response': 200, 'version': version, 'changed': True, 'data': active}, 200
+
+
+@route('/api/sync', methods=['POST'])
+@security.api_key_required
+def api_sync():
+    data = request.get_json(force=True)
+    station_id = g.api_key.station_id or data.get('station_id')
+    try:
+        cursor = int(data['cursor']) if data.get('cursor') is not None else None
+        results, acknowledged, cursor = sync.sync(g.api_key, station_id, data.get('events', []), cursor)
+    except (sync.SyncError, TypeError, ValueError) as e:
+        return {'response': 400, 'message': str(e)}, 400
+
+    version_name = models.Station.version_name(station_id) if station_id is not None else 'plug_job'
+    version = models.DataVersion.get_version(version_name)
+    response = {'response': 200, 'cursor': cursor, 'results': results, 'acknowledged': acknowledged, 'version': version, 'changed': data.get('since') != version}
+    if response['changed']:
+        response['data'] = active_jobs_json(station_id, data.get('include_config', False))
+    return response, 200
+
+
+@route('/api/queue', methods=['GET', 'POST'])
+@security.api_key_required
+def api_queue():
+    data = request.get_json(force=True)
+    station_id = g.api_key.station_id or data.get('station_id')
+    if request.method == 'POST':
+        config = models.PlugConfig.get_by_id(data.get('config_id'))
+        if config is None or config.is_archived:
+            return {'response': 400, 'message': 'Please provide a valid config_id'}, 400
+        if station_id is not None and models.Station.get_by_id(station_id) is None:
+            return {'response': 400, 'message': 'The station does not exist'}, 400
+        try:
+            priority = int(data.get('priority', 0))
+        except (TypeError, ValueError):
+            return {'response': 400, 'message': 'priority must be an integer'}, 400
+        job = models.PlugJob.enqueue(config.id, station_id, priority)
+        return {'response': 201, 'data': job.json(include_config=False)}, 201
+    elif request.method == 'GET':
+        queued = [job.json(include_config=False) for job in models.PlugJob.get_queued(station_id)]
+        return {'response': 200, 'metrics': analytics.queue_metrics(), 'data': queued}, 200
 
 
-@app.route('/api/jobs', methods=['GET', 'POST'])
+@route('/api/claim', methods=['POST'])
 @security.api_key_required
+def api_claim():
+    data = request.get_json(force=True)
+    station_id = g.api_key.station_id or data.get('station_id')
+    if station_id is None or models.Station.get_by_id(station_id) is None:
+        return {'response': 400, 'message': 'Please provide a valid station_id'}, 400
+    job = models.PlugJob.claim_next(station_id)
+    if job is None:
+        return {'response': 200, 'data': None}, 200
+    return {'response': 200, 'data': job.json(include_config=data.get('include_config', True))}, 200
+
+
+@route('/api/jobs', methods=['GET', 'POST'])
+@security.api_key_required
+@replicas.reads
 def api_jobs():
     if request.method == 'GET':
         jobs = [job.json() for job in models.PlugJob.get_all()]
         return {'response': 200, 'data': jobs}, 200
 
 
-@app.route('/api/configs', methods=['GET', 'POST'])
+@route('/api/configs', methods=['GET', 'POST'])
 @security.api_key_required
 def api_configs():
     if request.method == 'GET':
-        configs = [config.json() for config in models.PlugConfig.get_all()]
+        versions = request.get_json(force=True).get('versions')
+        if versions is not None:
+            try:
+                versions = {int(id): version for id, version in versions.items()}
+            except (AttributeError, ValueError):
+                return {'response': 400, 'message': 'versions must map config ids to versions'}, 400
+        configs = models.PlugConfig.get_changed_json(versions)
         return {'response': 200, 'data': configs}, 200
 
 
-@app.route('/durations-plot.png')
+@route('/api/schedule/<int:config_id>', methods=['GET', 'POST'])
+@security.api_key_required
+def api_schedule(config_id):
+    result = models.PlugConfig.get_cure_schedule(config_id, request.get_json(force=True).get('version'))
+    if result is None:
+        return {'response': 404, 'message': 'The config does not exist'}, 404
+    version, schedule = result
+    response = Response(schedule, mimetype='application/octet-stream')
+    response.headers['X-Config-Version'] = str(version)
+    response.set_etag(f'{config_id}-{version}')
+    return response.make_conditional(request)
+
+
+@route('/api/insights', methods=['GET', 'POST'])
+@security.api_key_required
+@replicas.reads
+def api_insights():
+    data = request.get_json(force=True)
+    try:
+        metrics = analytics.job_metrics(data.get('start'), data.get('end'), data.get('bucket', 'hour'))
+    except (TypeError, ValueError) as e:
+        return {'response': 400, 'message': str(e)}, 400
+    return {'response': 200, 'data': metrics}, 200
+
+
+@route('/durations-plot.png')
 @login_required
+@replicas.reads
 def durations_plot():
-    fig = create_durations_plot()
-    output = io.BytesIO()
-    FigureCanvas(fig).print_png(output)
-    return Response(output.getvalue(), mimetype='image/png')
+    return plot_response(cached_plot('durations', create_durations_plot))
 
 
-@app.route('/status-plot.png')
+@route('/status-plot.png')
 @login_required
+@replicas.reads
 def status_plot():
-    fig = create_status_plot()
-    output = io.BytesIO()
-    FigureCanvas(fig).print_png(output)
-    return Response(output.getvalue(), mimetype='image/png')
+    return plot_response(cached_plot('status', create_status_plot))
 
 
-@app.route('/config-plot.png')
+@route('/config-plot.png')
 @login_required
+@replicas.reads
 def config_plot():
-    fig = create_config_plot()
-    output = io.BytesIO()
-    FigureCanvas(fig).print_png(output)
-    return Response(output.getvalue(), mimetype='image/png')
+    return plot_response(cached_plot('config', create_config_plot))
 
 
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout():
     logout_user()
@@ -474,6 +643,28 @@ def logout():
     return redirect(url_for('jobs'))
 
 
+def active_jobs_json(station_id, include_config):
+    jobs = models.PlugJob.get_active_with_config_versions(station_id)
+    job_estimates = estimates.for_jobs(jobs)
+    return [{**job.json(include_config=include_config), **estimates.to_json(job_estimates[job.id])} for job in jobs]
+
+
+def cached_plot(name, create_plot):
+    def render():
+        output = io.BytesIO()
+        FigureCanvas(create_plot()).print_png(output)
+        return output.getvalue()
+    return fragments.cached_fragment(('plot', name, fragments.data_versions()), render)
+
+
+def plot_response(png):
+    response = Response(png, mimetype='image/png')
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 def create_durations_plot():
     all = models.PlugJob.query.filter(models.PlugJob.duration.isnot(None)).order_by(models.PlugJob.end_time).limit(50).all()
     end_times = [job.end_time.strftime('%H:%M:%S') for job in all]
@@ -533,17 +724,6 @@ def create_config(form):
     return models.PlugConfig(
         name=form.name.data,
         cure_profile=form.cure_profile.data,
-        offset_x=form.offset_x.data,
-        offset_y=form.offset_y.data,
-        offset_z=form.offset_z.data,
-        vertical_gap_x=form.vertical_gap_x.data,
-        vertical_gap_y=form.vertical_gap_y.data,
-        vertical_gap_z=form.vertical_gap_z.data,
-        horizontal_gap_x=form.horizontal_gap_x.data,
-        horizontal_gap_y=form.horizontal_gap_y.data,
-        horizontal_gap_z=form.horizontal_gap_z.data,
-        slot_gap_x=form.slot_gap_x.data,
-        slot_gap_y=form.slot_gap_y.data,
-        slot_gap_z=form.slot_gap_z.data,
+        **{field: getattr(form, field).data for field in models.GEOMETRY_FIELDS},
         notes=form.notes.data
     )
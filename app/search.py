@@ -0,0 +1,162 @@
+'''Module for full-text search over jobs.
+
+A job matches a search when its notes, or its config's name or notes,
+contain every word searched for, in any form, so `crack` also finds
+`cracked` and `cracks`. The text search, status and date filters and
+pagination run as one query.
+
+On PostgreSQL the text is indexed by GIN indexes over `to_tsvector`
+expressions of the columns, which the database keeps up to date. SQLite
+has no such indexes, so there the text is copied into the FTS5 tables
+`plug_job_search` and `plug_config_search`, with the job or config id as
+their rowid. Routes that write the text call `index_job` or
+`index_config` before committing, and `rebuild` refills both tables,
+such as for a database created before search existed.
+
+'''
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import UnaryExpression
+
+import re
+
+from app import db, models
+
+
+SEARCH_LANGUAGE = 'english'
+MAX_WORDS = 16
+
+JOB_SEARCH_TABLE = 'plug_job_search'
+CONFIG_SEARCH_TABLE = 'plug_config_search'
+
+SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {JOB_SEARCH_TABLE} USING fts5(notes, tokenize='porter unicode61')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {CONFIG_SEARCH_TABLE} USING fts5(name, notes, tokenize='porter unicode61')",
+)
+POSTGRESQL_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_plug_job_search ON plug_job "
+    f"USING gin (to_tsvector('{SEARCH_LANGUAGE}', coalesce(notes, '')))",
+    "CREATE INDEX IF NOT EXISTS ix_plug_config_search ON plug_config "
+    f"USING gin (to_tsvector('{SEARCH_LANGUAGE}', name || ' ' || coalesce(notes, '')))",
+)
+
+for statement in SQLITE_DDL:
+    db.event.listen(db.metadata, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_DDL:
+    db.event.listen(db.metadata, 'after_create', db.DDL(statement).execute_if(dialect='postgresql'))
+for table in (JOB_SEARCH_TABLE, CONFIG_SEARCH_TABLE):
+    db.event.listen(db.metadata, 'before_drop', db.DDL(f'DROP TABLE IF EXISTS {table}').execute_if(dialect='sqlite'))
+
+
+def uses_fts():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def split_words(query):
+    return re.findall(r'\w+', (query or '').lower())[:MAX_WORDS]
+
+
+def job_vector():
+    # Must match the indexed expressions in POSTGRESQL_DDL exactly
+    language = db.literal_column(f"'{SEARCH_LANGUAGE}'")
+    return db.func.to_tsvector(language, db.func.coalesce(models.PlugJob.notes, db.literal_column("''")))
+
+
+def config_vector():
+    language = db.literal_column(f"'{SEARCH_LANGUAGE}'")
+    text = models.PlugConfig.name + db.literal_column("' '") + db.func.coalesce(models.PlugConfig.notes, db.literal_column("''"))
+    return db.func.to_tsvector(language, text)
+
+
+def fts_matches(table, words):
+    expression = ' '.join(f'"{word}"' for word in words)
+    return db.select(db.literal_column('rowid')).select_from(db.table(table)).where(db.literal_column(table).op('MATCH')(expression))
+
+
+def unindexed(column):
+    '''Returns `column` prefixed with a unary plus, which keeps SQLite
+    from filtering through an index on it.
+
+    '''
+    return UnaryExpression(column, operator=operators.custom_op('+'), type_=column.type)
+
+
+def text_condition(words):
+    '''Returns the condition matching jobs against `words`.'''
+    if uses_fts():
+        config_jobs = db.select(models.PlugJob.id).where(models.PlugJob.config_id.in_(fts_matches(CONFIG_SEARCH_TABLE, words)))
+        return models.PlugJob.id.in_(db.union(fts_matches(JOB_SEARCH_TABLE, words), config_jobs))
+    query = db.func.to_tsquery(db.literal_column(f"'{SEARCH_LANGUAGE}'"), ' & '.join(words))
+    return db.or_(
+        job_vector().op('@@')(query),
+        models.PlugJob.config_id.in_(db.select(models.PlugConfig.id).where(config_vector().op('@@')(query))),
+    )
+
+
+def search_jobs(query, page, per_page, statuses=None, start=None, end=None):
+    '''Returns a page of jobs matching `query`, newest first, filtered to
+    `statuses` and to jobs started from `start` until before `end`.
+
+    '''
+    statement = db.select(models.PlugJob).order_by(models.PlugJob.id.desc())
+    status, start_time = models.PlugJob.status, models.PlugJob.start_time
+    words = split_words(query)
+    if words:
+        statement = statement.where(text_condition(words))
+        if uses_fts():
+            # Without statistics SQLite guesses the status and start time
+            # indexes are more selective than the text, and scans them
+            status, start_time = unindexed(status), unindexed(start_time)
+    if statuses:
+        statement = statement.where(status.in_(statuses))
+    if start is not None:
+        statement = statement.where(start_time >= start)
+    if end is not None:
+        statement = statement.where(start_time < end)
+    return db.paginate(statement, page=page, per_page=per_page, error_out=False)
+
+
+def index_job(job):
+    '''Updates `job`'s notes in the SQLite index, in the session's
+    transaction.
+
+    '''
+    if not uses_fts():
+        return
+    db.session.execute(db.text(f'DELETE FROM {JOB_SEARCH_TABLE} WHERE rowid = :id'), {'id': job.id})
+    if job.notes:
+        db.session.execute(db.text(f'INSERT INTO {JOB_SEARCH_TABLE} (rowid, notes) VALUES (:id, :notes)'), {'id': job.id, 'notes': job.notes})
+
+
+def index_config(config):
+    '''Updates `config`'s name and notes in the SQLite index, in the
+    session's transaction. Adds a new config to the session first, so it
+    has an id.
+
+    '''
+    if not uses_fts():
+        return
+    if config.id is None:
+        db.session.add(config)
+        db.session.flush()
+    db.session.execute(db.text(f'DELETE FROM {CONFIG_SEARCH_TABLE} WHERE rowid = :id'), {'id': config.id})
+    db.session.execute(
+        db.text(f'INSERT INTO {CONFIG_SEARCH_TABLE} (rowid, name, notes) VALUES (:id, :name, :notes)'),
+        {'id': config.id, 'name': config.name, 'notes': config.notes or ''}
+    )
+
+
+def rebuild():
+    '''Creates the index if missing. On SQLite, also refills it from the
+    jobs and configs tables.
+
+    '''
+    if not uses_fts():
+        db.create_all()
+        return
+    for statement in SQLITE_DDL:
+        db.session.execute(db.text(statement))
+    db.session.execute(db.text(f'DELETE FROM {JOB_SEARCH_TABLE}'))
+    db.session.execute(db.text(f"INSERT INTO {JOB_SEARCH_TABLE} (rowid, notes) SELECT id, notes FROM plug_job WHERE notes != ''"))
+    db.session.execute(db.text(f'DELETE FROM {CONFIG_SEARCH_TABLE}'))
+    db.session.execute(db.text(f"INSERT INTO {CONFIG_SEARCH_TABLE} (rowid, name, notes) SELECT id, name, coalesce(notes, '') FROM plug_config"))
+    db.session.commit()
@@ -1,8 +1,8 @@
-from flask import request
+from flask import request, g
 
 import functools
 
-from app import models
+from app import models, ratelimit
 
 
 def is_valid_api_key(api_key):
@@ -14,9 +14,13 @@ def api_key_required(func):
     def decorator(*args, **kwargs):
         data = request.get_json(force=True)
         if data:
-            api_key = data['api_key']
-            if is_valid_api_key(api_key):
-                return func(*args, **kwargs)
+            api_key = models.APIKey.get_by_key(data['api_key'])
+            if api_key is not None:
+                g.api_key = api_key
+                with ratelimit.admit(api_key) as rejected:
+                    if rejected is not None:
+                        return rejected
+                    return func(*args, **kwargs)
             else:
                 return {'response': 403, 'message': 'The provided API key is not valid'}, 403
         else:
@@ -0,0 +1,39 @@
+'''Module for state kept in a SQLite file shared by the workers on a
+host, such as the SQLite cache and rate limit backends.
+
+'''
+import os
+import sqlite3
+import threading
+
+
+class SQLiteFile():
+    '''Base for stores in the SQLite file at `path`. Creates the file in
+    WAL mode with the `schema` statements, then gives each thread its
+    own connection in autocommit mode.
+
+    '''
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.local = threading.local()
+        connection = self.connect()
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in schema:
+                connection.execute(statement)
+        finally:
+            connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA synchronous=OFF')
+        return connection
+
+    @property
+    def connection(self):
+        # Connections are per thread and must not survive a fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.connection
@@ -0,0 +1,139 @@
+'''Module for applying batches of job status events from controllers.
+
+A controller that loses its connection buffers status changes and
+uploads them together when it reconnects. Each event carries a key the
+controller generates and the time the change happened on the device.
+Events are applied in the order sent, in one transaction, and recorded
+with their result under their key, so uploading a batch again returns
+the recorded results without changing any job twice.
+
+Every recorded event gets the next sync cursor for its API key. A
+controller that sends its last cursor gets back the results of events
+recorded since then, so after a lost response it can clear them from
+its buffer without uploading them again.
+
+'''
+from sqlalchemy.exc import IntegrityError
+
+from datetime import datetime
+
+from app import db, models
+
+
+MAX_EVENTS = 500
+END_STATUSES = ('finished', 'failed', 'stopped')
+# Bounds of the `SyncEvent` columns events are recorded in
+MAX_KEY_LENGTH = models.SyncEvent.idempotency_key.type.length
+MAX_STATUS_LENGTH = models.SyncEvent.status.type.length
+MIN_ID, MAX_ID = -2 ** 31, 2 ** 31 - 1
+
+
+class SyncError(Exception):
+    pass
+
+
+def parse_device_time(value):
+    if value is None:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('time must be a timestamp in seconds')
+
+
+def apply_event(job, station_id, status, device_time, now):
+    '''Applies one event to `job`. Returns `(result, message)`, where the
+    result is ``applied``, ``ignored`` when the job has already ended, or
+    ``rejected``.
+
+    '''
+    if job is None:
+        return 'rejected', 'The job does not exist'
+    if station_id is not None and job.station_id not in (station_id, None):
+        return 'rejected', 'The job belongs to another station'
+    if status not in END_STATUSES:
+        return 'rejected', f'status must be one of {", ".join(END_STATUSES)}'
+
+    if job.is_queued():
+        if status != 'stopped':
+            return 'rejected', 'A queued job can only be stopped'
+        job.status = models.StatusEnum.stopped
+        job.end_time = min(device_time or now, now)
+        return 'applied', None
+    if not job.is_active():
+        return 'ignored', f'The job is already {job.status.value}'
+
+    # Device clocks drift, so keep the end inside the job's lifetime
+    job.status = models.StatusEnum[status]
+    job.set_ended(min(max(device_time or now, job.start_time), now))
+    return 'applied', None
+
+
+def apply_events(api_key, station_id, events):
+    recorded = models.SyncEvent.get_by_keys(api_key.id, [event['key'] for event in events])
+    jobs = {job.id: job for job in models.PlugJob.query.filter(models.PlugJob.id.in_([event['id'] for event in events]))}
+    now = datetime.now()
+    results = []
+    for event in events:
+        if event['key'] in recorded:
+            results.append({**recorded[event['key']].json(), 'duplicate': True})
+            continue
+        result, message = apply_event(jobs.get(event['id']), station_id, event['status'], event['time'], now)
+        sync_event = models.SyncEvent(api_key.id, event['key'], event['id'] if event['id'] in jobs else None, event['status'], event['time'], result, message)
+        db.session.add(sync_event)
+        recorded[event['key']] = sync_event
+        results.append(sync_event.json())
+    return results
+
+
+def validate(events):
+    '''Returns the events normalized, or raises `SyncError`.'''
+    if not isinstance(events, list):
+        raise SyncError('events must be a list')
+    if len(events) > MAX_EVENTS:
+        raise SyncError(f'Send at most {MAX_EVENTS} events at once')
+    normalized = []
+    for event in events:
+        try:
+            key = str(event['key'])
+            if not key or len(key) > MAX_KEY_LENGTH:
+                raise ValueError(f'key must be 1 to {MAX_KEY_LENGTH} characters')
+            id = int(event['id'])
+            if not MIN_ID <= id <= MAX_ID:
+                raise ValueError('id must be a 32-bit integer')
+            status = str(event['status'])
+            if len(status) > MAX_STATUS_LENGTH:
+                raise ValueError(f'status must be at most {MAX_STATUS_LENGTH} characters')
+            normalized.append({
+                'key': key,
+                'id': id,
+                'status': status,
+                'time': parse_device_time(event.get('time')),
+            })
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise SyncError(f'Invalid event {event!r}: {e}')
+    return normalized
+
+
+def sync(api_key, station_id, events, cursor=None):
+    '''Applies `events` for `api_key` and returns their results, the
+    results of other events recorded after `cursor`, and the new cursor.
+
+    '''
+    events = validate(events)
+    for attempt in range(2):
+        try:
+            results = apply_events(api_key, station_id, events)
+            db.session.commit()
+            break
+        except IntegrityError:
+            # A concurrent upload recorded one of the keys first. Retrying
+            # reports those events as duplicates.
+            db.session.rollback()
+            if attempt:
+                raise
+    keys = {event['key'] for event in events}
+    acknowledged = []
+    if cursor is not None:
+        acknowledged = [event.json() for event in models.SyncEvent.get_after(api_key.id, cursor) if event.idempotency_key not in keys]
+    return results, acknowledged, models.SyncEvent.get_cursor(api_key.id)
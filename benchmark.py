@@ -0,0 +1,917 @@
+'''Module for measuring app performance.
+
+Runs requests through the Flask test client against the configured
+database. Run from a Python shell after creating a database with
+`manage_db`:
+
+    >>> import benchmark
+    >>> benchmark.transfer_sizes()
+    >>> benchmark.serving_modes()
+    >>> benchmark.sign_ins()
+    >>> benchmark.geometry_queries()
+    >>> benchmark.analytics_metrics()
+    >>> benchmark.station_polls()
+    >>> benchmark.rate_limits()
+    >>> benchmark.queue_claims()
+    >>> benchmark.cache_backends()
+    >>> benchmark.statement_overhead()
+    >>> benchmark.search_queries()
+    >>> benchmark.cure_schedules()
+    >>> benchmark.duration_estimates()
+    >>> benchmark.check_duration_stats()
+    >>> benchmark.worker_startup()
+
+'''
+from flask import url_for
+
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import http.cookiejar
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import random
+import re
+import shutil
+import statistics
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from app import app, create_app, db, analytics, caching, cure, estimates, geometry, models, ratelimit, search
+
+
+def signed_in_client(email=None):
+    client = app.test_client()
+    with app.app_context():
+        user = models.User.get_by_email(email) if email else models.User.query.first()
+        user_id = user.id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client, user_id
+
+
+def session_cookie(email=None):
+    client, user_id = signed_in_client(email)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    for cookie in client.cookie_jar:
+        if cookie.name == cookie_name:
+            return f'{cookie_name}={cookie.value}', user_id
+
+
+def get_api_key(user_id):
+    with app.app_context():
+        key = models.APIKey.query.filter_by(user_id=user_id).first()
+        if key is None:
+            key = models.APIKey(name='benchmark', user_id=user_id)
+            key.save()
+        return key.key
+
+
+def transfer_sizes(email=None):
+    '''Prints the bytes sent for each page, API route and static asset
+    with and without compression, and whether repeat visits can be served
+    from the browser cache.
+
+    '''
+    client, user_id = signed_in_client(email)
+    api_key = get_api_key(user_id)
+
+    with app.test_request_context():
+        static_urls = [
+            url_for('static', filename='main.css'),
+            url_for('static', filename='img/fred.png'),
+            url_for('static', filename='img/robot_arm.jpeg'),
+        ]
+
+    routes = [
+        ('/', None),
+        ('/configs', None),
+        ('/insights', None),
+        ('/docs', None),
+        ('/durations-plot.png', None),
+        ('/status-plot.png', None),
+        ('/config-plot.png', None),
+        ('/api/active', {'api_key': api_key}),
+        ('/api/jobs', {'api_key': api_key}),
+        ('/api/configs', {'api_key': api_key}),
+    ] + [(url, None) for url in static_urls]
+
+    print(f'{"Route":<40} {"Identity":>10} {"Encoded":>10} {"Saved":>7}  Cache-Control')
+    total_identity = total_encoded = 0
+    for url, json in routes:
+        identity = client.get(url, json=json, headers={'Accept-Encoding': 'identity'})
+        encoded = client.get(url, json=json, headers={'Accept-Encoding': 'gzip, deflate, br'})
+        identity_size = len(identity.get_data())
+        encoded_size = len(encoded.get_data())
+        identity.close()
+        encoded.close()
+        total_identity += identity_size
+        total_encoded += encoded_size
+        saved = 100 * (1 - encoded_size / identity_size) if identity_size else 0
+        cache_control = encoded.headers.get('Cache-Control', '-')
+        print(f'{url[:40]:<40} {identity_size:>10} {encoded_size:>10} {saved:>6.1f}%  {cache_control}')
+    saved = 100 * (1 - total_encoded / total_identity) if total_identity else 0
+    print(f'{"Total":<40} {total_identity:>10} {total_encoded:>10} {saved:>6.1f}%')
+
+
+def start_server(port, env=None, args=()):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', *args, 'app:app'],
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def send(base_url, method, path, body=None, headers=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method, headers=headers or {})
+    if data is not None:
+        request.add_header('Content-Type', 'application/json')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            ok = response.status < 400
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_load(base_url, workload, clients, duration):
+    '''Runs `clients` concurrent loops for `duration` seconds, each
+    sending requests picked from `workload`, a list of
+    `(weight, method, path, body, headers)` tuples. Returns a list of
+    `(path, latency, ok)` tuples.
+
+    '''
+    weights = [item[0] for item in workload]
+    deadline = time.time() + duration
+
+    def client_loop(_):
+        results = []
+        while time.time() < deadline:
+            _, method, path, body, headers = random.choices(workload, weights)[0]
+            latency, ok = send(base_url, method, path, body, headers)
+            results.append((path, latency, ok))
+        return results
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        return [result for results in executor.map(client_loop, range(clients)) for result in results]
+
+
+def serving_modes(worker_classes=('sync', 'gthread', 'gevent'), workers=2, clients=32, duration=10, port=8765, email=None):
+    '''Starts gunicorn with each worker class and prints throughput and
+    latency percentiles under a mix of controller polls, job exports and
+    plot renders.
+
+    '''
+    cookie, user_id = session_cookie(email)
+    api_key = {'api_key': get_api_key(user_id)}
+    workload = [
+        (80, 'GET', '/api/active', api_key, None),
+        (10, 'GET', '/api/jobs', api_key, None),
+        (10, 'GET', '/status-plot.png', None, {'Cookie': cookie}),
+    ]
+
+    print(f'{"Worker class":<14} {"Req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"Errors":>7}')
+    for worker_class in worker_classes:
+        server = start_server(port, env={'GUNICORN_WORKER_CLASS': worker_class, 'WEB_CONCURRENCY': str(workers)})
+        try:
+            results = run_load(f'http://127.0.0.1:{port}', workload, clients, duration)
+        finally:
+            stop_server(server)
+        latencies = [latency * 1000 for _, latency, ok in results if ok]
+        errors = sum(1 for _, _, ok in results if not ok)
+        print(
+            f'{worker_class:<14} {len(results) / duration:>8.1f} {percentile(latencies, 50):>8.1f} '
+            f'{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f} {errors:>7}'
+        )
+
+
+def sign_in(base_url, email, password):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    start = time.perf_counter()
+    try:
+        with opener.open(base_url + '/', timeout=60) as response:
+            csrf_token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.read().decode()).group(1)
+        form = urllib.parse.urlencode({'csrf_token': csrf_token, 'email': email, 'password': password}).encode()
+        with opener.open(base_url + '/', data=form, timeout=60) as response:
+            ok = 'Logout' in response.read().decode()
+    except (urllib.error.URLError, OSError, AttributeError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def sign_ins(executors=('inline', 'thread', 'process'), burst=24, rounds=12, workers=2, duration=10, port=8766, email='user1@email.com', password='password1'):
+    '''Starts gunicorn with each hashing executor, then runs a burst of
+    concurrent sign-ins next to a controller polling `/api/active`.
+    Prints sign-in throughput and latency, and the poll latency seen
+    while the burst runs.
+
+    '''
+    with app.app_context():
+        user = models.User.get_by_email(email)
+        user_id = user.id
+    api_key = {'api_key': get_api_key(user_id)}
+    base_url = f'http://127.0.0.1:{port}'
+
+    print(f'{"Executor":<10} {"Logins/s":>9} {"Login p50":>10} {"Login p99":>10} {"Poll p50":>9} {"Poll p99":>9} {"Errors":>7}')
+    for executor in executors:
+        server = start_server(port, env={
+            'HASH_EXECUTOR': executor,
+            'BCRYPT_LOG_ROUNDS': str(rounds),
+            'WEB_CONCURRENCY': str(workers),
+        })
+        try:
+            deadline = time.time() + duration
+
+            def login_loop(_):
+                results = []
+                while time.time() < deadline:
+                    results.append(sign_in(base_url, email, password))
+                return results
+
+            with ThreadPoolExecutor(max_workers=burst) as pool:
+                logins = pool.map(login_loop, range(burst))
+                polls = run_load(base_url, [(1, 'GET', '/api/active', api_key, None)], 1, duration)
+                logins = [result for results in logins for result in results]
+        finally:
+            stop_server(server)
+
+        login_latencies = [latency * 1000 for latency, ok in logins if ok]
+        poll_latencies = [latency * 1000 for _, latency, ok in polls if ok]
+        errors = sum(1 for _, ok in logins if not ok) + sum(1 for _, _, ok in polls if not ok)
+        print(
+            f'{executor:<10} {len(login_latencies) / duration:>9.1f} {percentile(login_latencies, 50):>10.1f} '
+            f'{percentile(login_latencies, 99):>10.1f} {percentile(poll_latencies, 50):>9.1f} '
+            f'{percentile(poll_latencies, 99):>9.1f} {errors:>7}'
+        )
+
+
+def geometry_queries(configs=5000, repeat=5, min_gap=0.5):
+    '''Adds `configs` temporary configs, then times a spacing check over
+    all of them done by loading ORM objects attribute by attribute versus
+    the packed geometry array. Rolls the configs back afterwards.
+
+    '''
+    with app.app_context():
+        rng = random.Random(0)
+        db.session.add_all(
+            models.PlugConfig(
+                name=f'Benchmark #{i}',
+                cure_profile='1',
+                **{field: rng.uniform(0.1, 5) for field in models.GEOMETRY_FIELDS}
+            )
+            for i in range(configs)
+        )
+        db.session.flush()
+
+        def orm_check():
+            db.session.expire_all()
+            violations = []
+            for config in models.PlugConfig.query.filter_by(is_archived=False).order_by(models.PlugConfig.id):
+                gaps = (
+                    (config.vertical_gap_x, config.vertical_gap_y, config.vertical_gap_z),
+                    (config.horizontal_gap_x, config.horizontal_gap_y, config.horizontal_gap_z),
+                    (config.slot_gap_x, config.slot_gap_y, config.slot_gap_z),
+                )
+                if any(sum(component ** 2 for component in gap) ** 0.5 < min_gap for gap in gaps):
+                    violations.append(config.id)
+            return violations
+
+        def array_check():
+            return geometry.find_spacing_violations(min_gap)
+
+        try:
+            for name, check in (('ORM objects', orm_check), ('Geometry array', array_check)):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    violations = check()
+                    timings.append(time.perf_counter() - start)
+                print(f'{name:<16} {statistics.median(timings) * 1000:>8.1f} ms  {len(violations)} violations')
+        finally:
+            db.session.rollback()
+
+
+def analytics_metrics(rows=2000000, loop_rows=200000, db_rows=200000, days=365, chunk_size=50000):
+    '''Times hourly bucketed metrics over a year of synthetic jobs: the
+    NumPy accumulator over `rows` jobs, a per-job Python loop over
+    `loop_rows` jobs, and the full database path over `db_rows` temporary
+    jobs, which are rolled back afterwards.
+
+    '''
+    rng = np.random.default_rng(0)
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    start_seconds, end_seconds = analytics.to_seconds([start, end])
+    starts = np.sort(rng.uniform(start_seconds, end_seconds, rows))
+    ends = starts + rng.uniform(20 * 60, 100 * 60, rows)
+    statuses = rng.choice([analytics.FINISHED, analytics.FAILED, analytics.STOPPED], rows, p=[0.8, 0.1, 0.1])
+    config_ids = rng.integers(1, 21, rows)
+
+    begin = time.perf_counter()
+    metrics = analytics.BucketedMetrics(start_seconds, end_seconds, 3600)
+    for i in range(0, rows, chunk_size):
+        chunk = slice(i, i + chunk_size)
+        metrics.add(starts[chunk], ends[chunk], statuses[chunk], config_ids[chunk])
+    metrics.result()
+    elapsed = time.perf_counter() - begin
+    print(f'{"NumPy accumulator":<20} {rows:>9} rows {elapsed * 1000:>9.1f} ms  {rows / elapsed:>12,.0f} rows/s')
+
+    begin = time.perf_counter()
+    started, busy, outcomes = {}, {}, {}
+    for job_start, job_end, status, config_id in zip(starts[:loop_rows], ends[:loop_rows], statuses[:loop_rows], config_ids[:loop_rows]):
+        bucket = int((job_start - start_seconds) // 3600)
+        started[bucket] = started.get(bucket, 0) + 1
+        t = job_start
+        while t < min(job_end, end_seconds):
+            bucket = int((t - start_seconds) // 3600)
+            bucket_end = start_seconds + (bucket + 1) * 3600
+            busy[bucket] = busy.get(bucket, 0) + min(job_end, bucket_end) - t
+            t = bucket_end
+        key = (config_id, status)
+        outcomes[key] = outcomes.get(key, 0) + 1
+    elapsed = time.perf_counter() - begin
+    print(f'{"Python loop":<20} {loop_rows:>9} rows {elapsed * 1000:>9.1f} ms  {loop_rows / elapsed:>12,.0f} rows/s')
+
+    with app.app_context():
+        config_id = models.PlugConfig.query.first().id
+        status_enums = [analytics.STATUSES[code] for code in statuses[:db_rows]]
+        start_times = (starts[:db_rows] * 1e6).astype('datetime64[us]').tolist()
+        end_times = (ends[:db_rows] * 1e6).astype('datetime64[us]').tolist()
+        db.session.execute(db.insert(models.PlugJob), [
+            {'config_id': config_id, 'start_time': job_start, 'end_time': job_end, 'status': status, 'notes': ''}
+            for job_start, job_end, status in zip(start_times, end_times, status_enums)
+        ])
+        try:
+            begin = time.perf_counter()
+            analytics.job_metrics(start, end, 'hour', chunk_size)
+            elapsed = time.perf_counter() - begin
+            total = models.PlugJob.query.count()
+            print(f'{"Database + NumPy":<20} {total:>9} rows {elapsed * 1000:>9.1f} ms  {total / elapsed:>12,.0f} rows/s')
+        finally:
+            db.session.rollback()
+
+
+def station_polls(station_counts=(1, 10, 100), history_per_station=100, polls=300, email=None):
+    '''Adds temporary stations, each with one active job, finished job
+    history and its own API key. Times one station's controller polling
+    `/api/active`, both fetching its jobs and checking `since`, as the
+    station count grows. Deletes everything it added afterwards.
+
+    '''
+    client, user_id = signed_in_client(email)
+    with app.app_context():
+        config_id = models.PlugConfig.query.first().id
+
+    print(f'{"Stations":>8} {"Jobs":>8} {"Fetch us":>9} {"Since us":>9}')
+    for count in station_counts:
+        with app.app_context():
+            stations = [models.Station(name=f'Benchmark #{i}') for i in range(count)]
+            db.session.add_all(stations)
+            db.session.flush()
+            now = datetime.now()
+            db.session.execute(db.insert(models.PlugJob), [
+                {
+                    'config_id': config_id,
+                    'station_id': station.id,
+                    'start_time': now - timedelta(minutes=i + 1),
+                    'end_time': now - timedelta(minutes=i),
+                    'duration': 60.0,
+                    'status': models.StatusEnum.finished,
+                    'notes': ''
+                }
+                for station in stations for i in range(history_per_station)
+            ])
+            db.session.add_all(models.PlugJob(config_id=config_id, start_time=now, station_id=station.id) for station in stations)
+            keys = [models.APIKey(name='benchmark', user_id=user_id, station_id=station.id) for station in stations]
+            db.session.add_all(keys)
+            db.session.commit()
+            station_ids = [station.id for station in stations]
+            api_key = keys[0].key
+            total_jobs = models.PlugJob.query.count()
+
+        rate_limit_enabled = app.config['RATE_LIMIT_ENABLED']
+        app.config['RATE_LIMIT_ENABLED'] = False
+        try:
+            version = client.get('/api/active', json={'api_key': api_key}).json['version']
+            timings = {}
+            for name, body in (('fetch', {'api_key': api_key}), ('since', {'api_key': api_key, 'since': version})):
+                begin = time.perf_counter()
+                for _ in range(polls):
+                    client.get('/api/active', json=body)
+                timings[name] = (time.perf_counter() - begin) / polls * 1e6
+            print(f'{count:>8} {total_jobs:>8} {timings["fetch"]:>9.0f} {timings["since"]:>9.0f}')
+        finally:
+            app.config['RATE_LIMIT_ENABLED'] = rate_limit_enabled
+            with app.app_context():
+                models.APIKey.query.filter(models.APIKey.station_id.in_(station_ids)).delete()
+                models.PlugJob.query.filter(models.PlugJob.station_id.in_(station_ids)).delete()
+                models.DataVersion.query.filter(
+                    models.DataVersion.name.in_([models.Station.version_name(id) for id in station_ids])
+                ).delete()
+                models.Station.query.filter(models.Station.id.in_(station_ids)).delete()
+                db.session.commit()
+
+
+def rate_limits(calls=20000, hot_loop=2, email=None):
+    '''Prints the cost of one limiter check per backend, then polls
+    `/api/active` in a hot loop for `hot_loop` seconds and counts how many
+    requests are admitted.
+
+    '''
+    print(f'{"Backend":>8} {"Take us":>8} {"Slot us":>8}')
+    for name, backend in (
+        ('memory', ratelimit.MemoryBackend()),
+        ('sqlite', ratelimit.SQLiteBackend(os.path.join(tempfile.gettempdir(), 'benchmark_rate_limits.db'), 60)),
+    ):
+        begin = time.perf_counter()
+        for i in range(calls):
+            backend.take(f'{i % 100}:api_active', 1e9, 1e9, time.time())
+        take = (time.perf_counter() - begin) / calls * 1e6
+        begin = time.perf_counter()
+        for _ in range(calls):
+            token = backend.acquire('api_jobs', 2, time.time())
+            backend.release('api_jobs', token)
+        slot = (time.perf_counter() - begin) / calls * 1e6
+        print(f'{name:>8} {take:>8.1f} {slot:>8.1f}')
+
+    client, user_id = signed_in_client(email)
+    api_key = get_api_key(user_id)
+    statuses = {}
+    begin = time.perf_counter()
+    while time.perf_counter() - begin < hot_loop:
+        status = client.get('/api/active', json={'api_key': api_key}).status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f'Hot loop for {hot_loop}s: {statuses}')
+
+
+def queue_claims(jobs=500, claimers=16):
+    '''Queues `jobs` jobs for any station, then lets `claimers` threads,
+    one per station, claim and finish jobs until the queue is empty.
+    Checks that every job was claimed exactly once and prints the claim
+    latency. Runs against the configured database, so the claims contend
+    as they would in production, and deletes what it added afterwards.
+
+    '''
+    with app.app_context():
+        config_id = models.PlugConfig.query.first().id
+        stations = [models.Station(name=f'Benchmark #{i}') for i in range(claimers)]
+        db.session.add_all(stations)
+        db.session.commit()
+        station_ids = [station.id for station in stations]
+        now = datetime.now()
+        db.session.add_all(
+            models.PlugJob(config_id=config_id, start_time=None, station_id=None, status=models.StatusEnum.queued, priority=i % 3, queued_time=now)
+            for i in range(jobs)
+        )
+        db.session.commit()
+        queued_ids = {job.id for job in models.PlugJob.get_queued()}
+
+    def claim_all(station_id):
+        claimed, latencies, empty = [], [], 0
+        with app.app_context():
+            while empty < 3:
+                begin = time.perf_counter()
+                job = models.PlugJob.claim_next(station_id)
+                latencies.append(time.perf_counter() - begin)
+                if job is None:
+                    empty += 1
+                    continue
+                empty = 0
+                claimed.append(job.id)
+                job.status = models.StatusEnum.finished
+                job.end()
+        return claimed, latencies
+
+    try:
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(claimers) as executor:
+            results = list(executor.map(claim_all, station_ids))
+        elapsed = time.perf_counter() - begin
+        claimed = [job_id for ids, _ in results for job_id in ids]
+        latencies = [latency * 1000 for _, times in results for latency in times]
+        print(f'Claimed {len(claimed)} of {jobs} jobs in {elapsed:.2f}s ({len(claimed) / elapsed:.0f}/s) with {claimers} claimers')
+        print(f'Double claims: {len(claimed) - len(set(claimed))}, unclaimed: {len(queued_ids - set(claimed))}')
+        print(f'Claim ms p50 {percentile(latencies, 50):.1f}, p95 {percentile(latencies, 95):.1f}, p99 {percentile(latencies, 99):.1f}')
+        with app.app_context():
+            print(f'Queue metrics: {analytics.queue_metrics()}')
+    finally:
+        with app.app_context():
+            models.PlugJob.query.filter(models.PlugJob.id.in_(queued_ids)).delete()
+            models.DataVersion.query.filter(
+                models.DataVersion.name.in_([models.Station.version_name(id) for id in station_ids])
+            ).delete()
+            models.Station.query.filter(models.Station.id.in_(station_ids)).delete()
+            # Finishing the jobs recorded their durations
+            models.DurationStats.rebuild()
+            db.session.commit()
+
+
+def cache_backends(calls=5000, email=None):
+    '''Prints get and set latency for each cache backend, using a
+    rendered jobs page as the value. Each shared backend is read through a
+    second instance, as another worker would.
+
+    '''
+    client, _ = signed_in_client(email)
+    value = client.get('/').data.decode('utf-8')
+    path = os.path.join(tempfile.gettempdir(), 'benchmark_cache.db')
+    server = caching.LocalRedis()
+    backends = (
+        ('memory', caching.MemoryCache(), None),
+        ('sqlite', caching.SQLiteCache(path), caching.SQLiteCache(path)),
+        ('redis', caching.RedisCache(server), caching.RedisCache(server)),
+    )
+    print(f'{"Backend":>8} {"Bytes":>8} {"Set us":>8} {"Get us":>8} {"Shared":>8}')
+    for name, backend, other_worker in backends:
+        backend.clear()
+        begin = time.perf_counter()
+        for i in range(calls):
+            backend.set(('jobs', i % 100), value)
+        set_time = (time.perf_counter() - begin) / calls * 1e6
+        begin = time.perf_counter()
+        for i in range(calls):
+            backend.get(('jobs', i % 100))
+        get_time = (time.perf_counter() - begin) / calls * 1e6
+        shared = other_worker is not None and other_worker.get(('jobs', 0)) == value
+        print(f'{name:>8} {len(value):>8} {set_time:>8.1f} {get_time:>8.1f} {str(shared):>8}')
+
+
+def statement_overhead(calls=2000, email='user1@email.com'):
+    '''Prints the per-call time of the hot model helpers, which use
+    cached lambda statements, against the same queries built with
+    `Model.query.filter_by(...)` on every call.
+
+    '''
+    with app.app_context():
+        user = models.User.get_by_email(email)
+        key = get_api_key(user.id)
+        station_id = models.Station.query.first().id
+        job = models.PlugJob
+
+        def old_page(sort_by):
+            if sort_by == 'name':
+                query = job.query.join(models.PlugConfig).order_by(models.PlugConfig.name.desc())
+            else:
+                query = job.query.order_by(models.JOB_ORDERS[sort_by])
+            return query.filter(job.query_is_active).paginate(page=1, per_page=10)
+
+        cases = [
+            ('User.get_by_email',
+                lambda: models.User.query.filter_by(email=email).first(),
+                lambda: models.User.get_by_email(email)),
+            ('UserSettings.get_by_user_id',
+                lambda: models.UserSettings.query.filter_by(user_id=user.id).first(),
+                lambda: models.UserSettings.get_by_user_id(user.id)),
+            ('APIKey.get_by_key',
+                lambda: models.APIKey.query.filter_by(key=key).first(),
+                lambda: models.APIKey.get_by_key(key)),
+            ('PlugJob.get_active',
+                lambda: job.query.filter_by(status=models.StatusEnum.started).filter_by(station_id=station_id).all(),
+                lambda: job.get_active(station_id)),
+            ('PlugJob.paginate_jobs',
+                lambda: [old_page(sort_by.value) for sort_by in models.SortByEnum],
+                lambda: [job.paginate_jobs(1, 10, sort_by.value, True) for sort_by in models.SortByEnum]),
+        ]
+        print(f'{"Helper":<28} {"Query us":>9} {"Lambda us":>10} {"Saved":>6}')
+        for name, old, new in cases:
+            timings = []
+            for func in (old, new):
+                func()
+                begin = time.perf_counter()
+                for _ in range(calls):
+                    func()
+                    db.session.expunge_all()
+                timings.append((time.perf_counter() - begin) / calls * 1e6)
+            print(f'{name:<28} {timings[0]:>9.0f} {timings[1]:>10.0f} {1 - timings[1] / timings[0]:>6.0%}')
+
+
+def search_queries(jobs=100000, repeat=20, words=('crack', 'smooth', 'delaminated')):
+    '''Adds `jobs` temporary jobs with random notes, then times a page of
+    finished jobs whose notes contain a word, found with the full-text
+    index versus `LIKE '%word%'`. `delaminated` is in one note in 500.
+    Rolls the jobs back afterwards.
+
+    '''
+    vocabulary = ['cracked', 'bubbles', 'warped', 'smooth', 'layer', 'cure', 'retry', 'ok', 'slow', 'fast', 'uneven', 'clean']
+    with app.app_context():
+        rng = random.Random(0)
+        last_id = db.session.query(db.func.max(models.PlugJob.id)).scalar() or 0
+        config_id = models.PlugConfig.query.first().id
+        now = datetime.now()
+        db.session.execute(db.insert(models.PlugJob), [{
+            'config_id': config_id,
+            'station_id': None,
+            'start_time': now - timedelta(minutes=i),
+            'status': models.StatusEnum.finished if rng.random() < 0.8 else models.StatusEnum.failed,
+            'notes': ' '.join(rng.choices(vocabulary, k=rng.randint(1, 6)) + ['delaminated'] * (rng.random() < 0.002)) if rng.random() < 0.3 else '',
+            'priority': 0,
+        } for i in range(jobs)])
+        if search.uses_fts():
+            db.session.execute(
+                db.text(f"INSERT INTO {search.JOB_SEARCH_TABLE} (rowid, notes) SELECT id, notes FROM plug_job WHERE id > :id AND notes != ''"),
+                {'id': last_id}
+            )
+
+        def like_page(word):
+            statement = db.select(models.PlugJob).where(
+                models.PlugJob.notes.like(f'%{word}%'), models.PlugJob.status == models.StatusEnum.finished
+            ).order_by(models.PlugJob.id.desc())
+            return db.paginate(statement, page=1, per_page=10, error_out=False)
+
+        def search_page(word):
+            return search.search_jobs(word, 1, 10, [models.StatusEnum.finished])
+
+        try:
+            print(f'{"Word":<12} {"LIKE ms":>8} {"Index ms":>9} {"Matches":>8}')
+            for word in words:
+                timings = []
+                for page in (like_page, search_page):
+                    durations = []
+                    for _ in range(repeat):
+                        begin = time.perf_counter()
+                        result = page(word)
+                        durations.append(time.perf_counter() - begin)
+                        db.session.expunge_all()
+                    timings.append(statistics.median(durations) * 1000)
+                print(f'{word:<12} {timings[0]:>8.1f} {timings[1]:>9.1f} {result.total:>8}')
+        finally:
+            db.session.rollback()
+
+
+def cure_schedules(calls=2000, email=None):
+    '''Prints the time per request and the response size of fetching a
+    config's compiled cure schedule, with and without a known version,
+    next to fetching the config's JSON.
+
+    '''
+    with app.app_context():
+        user = models.User.get_by_email(email) if email else models.User.query.first()
+        key = get_api_key(user.id)
+        config = models.PlugConfig.query.first()
+        config_id, version = config.id, config.version
+    client = app.test_client()
+    cases = [
+        ('/api/configs', '/api/configs', {'api_key': key, 'versions': {}}),
+        ('/api/schedule', f'/api/schedule/{config_id}', {'api_key': key}),
+        ('/api/schedule version', f'/api/schedule/{config_id}', {'api_key': key, 'version': version}),
+    ]
+    enabled = app.config['RATE_LIMIT_ENABLED']
+    app.config['RATE_LIMIT_ENABLED'] = False
+    try:
+        print(f'{"Request":<24} {"us":>6} {"Bytes":>6}')
+        for name, path, body in cases:
+            size = len(client.get(path, json=body).data)
+            begin = time.perf_counter()
+            for _ in range(calls):
+                client.get(path, json=body)
+            print(f'{name:<24} {(time.perf_counter() - begin) / calls * 1e6:>6.0f} {size:>6}')
+    finally:
+        app.config['RATE_LIMIT_ENABLED'] = enabled
+    begin = time.perf_counter()
+    for _ in range(calls):
+        cure.compile_profile('1' * 16 + '0' * 8 + '1' * 8)
+    print(f'compile 32 steps {(time.perf_counter() - begin) / calls * 1e6:.1f} us')
+
+
+@contextlib.contextmanager
+def scratch_app(configs=8):
+    '''Yields an app context on a new SQLite database with `configs`
+    plug configs, in a temporary directory deleted afterwards, so the
+    configured database is left untouched.
+
+    '''
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    scratch = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "scratch.db")}',
+        'SQLALCHEMY_BINDS': {},
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'CACHE_BACKEND': 'memory',
+    })
+    try:
+        with scratch.app_context():
+            try:
+                db.create_all()
+                for i in range(configs):
+                    db.session.add(models.PlugConfig(f'Scratch #{i}', '1', *[1.0] * len(models.GEOMETRY_FIELDS)))
+                db.session.commit()
+                yield scratch
+            finally:
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def finish_jobs(rng, typical, jobs, now):
+    '''Adds `jobs` ended jobs, mostly finished, one at a time through
+    `PlugJob.set_ended`, with durations around each config's `typical`.
+
+    '''
+    config_ids = list(typical)
+    for i in range(jobs):
+        config_id = rng.choice(config_ids)
+        start_time = now - timedelta(days=1, seconds=i)
+        job = models.PlugJob(config_id=config_id, start_time=start_time, station_id=None)
+        job.status = rng.choice([models.StatusEnum.finished] * 8 + [models.StatusEnum.failed, models.StatusEnum.stopped])
+        db.session.add(job)
+        job.set_ended(start_time + timedelta(seconds=max(1.0, rng.gauss(typical[config_id], typical[config_id] / 10))))
+        if i % 1000 == 999:
+            db.session.flush()
+            db.session.expunge_all()
+    db.session.flush()
+
+
+def running_jobs(rng, typical, active, now):
+    '''Returns `active` unsaved running jobs, started up to twice their
+    config's `typical` duration ago, so some are overrunning.
+
+    '''
+    config_ids = list(typical)
+    running = []
+    for i in range(active):
+        config_id = rng.choice(config_ids)
+        job = models.PlugJob(config_id=config_id, start_time=now - timedelta(seconds=rng.uniform(0, 2 * typical[config_id])), station_id=None)
+        job.id = -i - 1
+        running.append(job)
+    return running
+
+
+def recomputed_stats():
+    return {id: models.DurationStats(id, *values) for id, values in models.DurationStats.recompute().items()}
+
+
+def recomputed_estimates(running, stats, now):
+    return {job.id: estimates.estimate(job.start_time, stats.get(job.config_id), now) for job in running}
+
+
+def check_duration_stats(jobs=2000, active=200, seed=0):
+    '''Finishes `jobs` jobs through `PlugJob.set_ended` on a scratch
+    database and asserts that the stored count, mean and stdev of every
+    config, and the overrun flags of `active` running jobs, equal a full
+    recompute from the job table. Runs unattended:
+
+        python3 -c 'import benchmark; benchmark.check_duration_stats()'
+
+    '''
+    with scratch_app():
+        rng = random.Random(seed)
+        typical = {id: rng.uniform(300, 3600) for id, in db.session.query(models.PlugConfig.id)}
+        now = datetime.now()
+        finish_jobs(rng, typical, jobs, now)
+        db.session.commit()
+
+        stored = {stats.config_id: stats for stats in models.DurationStats.query}
+        recomputed = recomputed_stats()
+        assert stored.keys() == recomputed.keys(), (stored.keys(), recomputed.keys())
+        for id, stats in recomputed.items():
+            assert stored[id].count == stats.count, (id, stored[id], stats)
+            assert math.isclose(stored[id].mean, stats.mean, rel_tol=1e-9), (id, stored[id], stats)
+            assert math.isclose(stored[id].stdev, stats.stdev, rel_tol=1e-9), (id, stored[id], stats)
+
+        running = running_jobs(rng, typical, active, now)
+        incremental = {id: estimate.overrunning for id, estimate in estimates.for_jobs(running, now).items()}
+        full = {id: estimate.overrunning for id, estimate in recomputed_estimates(running, recomputed, now).items()}
+        assert incremental == full
+        assert any(full.values()) and not all(full.values()), 'the check needs both overrunning and on-time jobs'
+    print(f'Duration statistics of {len(recomputed)} configs and {active} overrun flags match a full recompute')
+
+
+def duration_estimates(jobs=20000, active=50, repeat=20):
+    '''Finishes `jobs` jobs one at a time through `PlugJob.set_ended`,
+    which updates the running duration statistics, on a scratch database.
+    Then compares the statistics and the estimates for `active` running
+    jobs with a full recompute from the job table, and times both.
+
+    '''
+    with scratch_app():
+        rng = random.Random(0)
+        # Give configs different typical durations
+        typical = {id: rng.uniform(300, 3600) for id, in db.session.query(models.PlugConfig.id)}
+        now = datetime.now()
+        begin = time.perf_counter()
+        finish_jobs(rng, typical, jobs, now)
+        print(f'Finished {jobs} jobs in {(time.perf_counter() - begin) / jobs * 1e6:.0f} us each, stats included')
+
+        running = running_jobs(rng, typical, active, now)
+        stored = {stats.config_id: stats for stats in models.DurationStats.query}
+        recomputed = recomputed_stats()
+        mean_error = max(abs(stored[id].mean - stats.mean) / stats.mean for id, stats in recomputed.items())
+        stdev_error = max(abs(stored[id].stdev - stats.stdev) / stats.stdev for id, stats in recomputed.items())
+        counts_match = stored.keys() == recomputed.keys() and all(stored[id].count == stats.count for id, stats in recomputed.items())
+        print(f'Counts match: {counts_match}, max relative error of mean {mean_error:.1e}, of stdev {stdev_error:.1e}')
+
+        incremental = estimates.for_jobs(running, now)
+        full = recomputed_estimates(running, recomputed, now)
+        eta_error = max(abs((incremental[id].eta - full[id].eta).total_seconds()) for id in full)
+        flags_match = all(incremental[id].overrunning == full[id].overrunning for id in full)
+        overrunning = sum(estimate.overrunning for estimate in full.values())
+        print(f'Estimates: max ETA difference {eta_error * 1000:.3f} ms, overrunning flags match: {flags_match} ({overrunning} of {active})')
+
+        timings = []
+        for compute in (lambda: estimates.for_jobs(running, now), lambda: recomputed_estimates(running, recomputed_stats(), now)):
+            begin = time.perf_counter()
+            for _ in range(repeat):
+                compute()
+            timings.append((time.perf_counter() - begin) / repeat * 1000)
+        print(f'Estimating {active} active jobs: stored stats {timings[0]:.2f} ms, full recompute {timings[1]:.1f} ms')
+
+
+def memory_kb(pid):
+    '''Returns the `(pss, private)` memory of a process in kB, read from
+    `/proc`, so Linux only.
+
+    '''
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def worker_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def worker_startup(workers=4, requests=200, port=8772, email=None):
+    '''Starts gunicorn with and without `preload_app`, then prints the
+    time until every worker is ready and the memory used once each has
+    served requests. Private memory is what a worker does not share with
+    the master or other workers.
+
+    '''
+    cookie, user_id = session_cookie(email)
+    api_key = {'api_key': get_api_key(user_id)}
+    workload = [
+        (60, 'GET', '/api/active', api_key, None),
+        (20, 'GET', '/', None, {'Cookie': cookie}),
+        (20, 'GET', '/insights', None, {'Cookie': cookie}),
+    ]
+
+    print(f'{"Preload":<8} {"Ready s":>8} {"Worker private MB":>18} {"Total PSS MB":>13}')
+    for preload in ('false', 'true'):
+        with tempfile.TemporaryFile('w+') as log:
+            begin = time.perf_counter()
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+                env={**os.environ, 'GUNICORN_PRELOAD': preload, 'WEB_CONCURRENCY': str(workers), 'RATE_LIMIT_ENABLED': 'false'},
+                stdout=subprocess.DEVNULL,
+                stderr=log
+            )
+            try:
+                while True:
+                    log.seek(0)
+                    if log.read().count('Worker ready') >= workers:
+                        break
+                    if time.perf_counter() - begin > 60:
+                        raise RuntimeError('Workers did not start')
+                    time.sleep(0.02)
+                ready = time.perf_counter() - begin
+
+                for _ in range(requests):
+                    _, method, path, body, headers = random.choices(workload, [item[0] for item in workload])[0]
+                    send(f'http://127.0.0.1:{port}', method, path, body, headers)
+                children = worker_pids(server.pid)
+                private = statistics.mean(memory_kb(pid)[1] for pid in children) / 1024
+                total = sum(memory_kb(pid)[0] for pid in [server.pid, *children]) / 1024
+            finally:
+                stop_server(server)
+        print(f'{preload:<8} {ready:>8.2f} {private:>18.1f} {total:>13.1f}')
@@ -0,0 +1,71 @@
+'''Gunicorn configuration for serving the Flask app.
+
+Gunicorn loads this file automatically from the working directory. Every
+setting can be overridden with an environment variable, so the serving
+mode can be changed on Heroku without a deploy:
+
+* ``GUNICORN_WORKER_CLASS=gthread`` (default) serves each worker's
+  requests from a thread pool. A slow plot render only holds one thread,
+  and the stock psycopg2 driver is safe to use.
+* ``GUNICORN_WORKER_CLASS=gevent`` serves up to
+  ``GUNICORN_WORKER_CONNECTIONS`` cooperative connections per worker,
+  which suits many controllers holding open connections. Requires
+  `gevent` and `psycogreen`, which make psycopg2 yield to other
+  greenlets while it waits on the database.
+* ``GUNICORN_WORKER_CLASS=eventlet`` is the same with `eventlet` in
+  place of `gevent`.
+* ``GUNICORN_WORKER_CLASS=sync`` is the previous one-request-per-worker
+  behaviour.
+
+``GUNICORN_PRELOAD`` loads the app once in the master before forking
+workers. It defaults to on, except for gevent and eventlet.
+
+Keep ``WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW)`` below the
+database's connection limit.
+
+'''
+import multiprocessing
+import os
+
+
+bind = f'0.0.0.0:{os.environ.get("PORT", 8000)}'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+# Loading the app once in the master lets workers share its memory
+# copy-on-write. gevent and eventlet patch the standard library in each
+# worker, after which objects made in the master would hold unpatched
+# locks, so they load the app in each worker instead.
+preload_app = os.environ.get('GUNICORN_PRELOAD', str(worker_class not in ('gevent', 'eventlet'))).lower() == 'true'
+
+
+def when_ready(server):
+    if preload_app:
+        from app import app, warm_up
+        warm_up(app)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    elif worker_class == 'eventlet':
+        from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+    if preload_app:
+        from app import app, init_worker
+        init_worker(app)
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        from app import app, warm_up
+        warm_up(app)
+    worker.log.info('Worker ready (pid: %s)', worker.pid)
@@ -0,0 +1,298 @@
+'''Module for end-to-end load tests.
+
+Seeds a fresh SQLite database, starts gunicorn on it and runs simulated
+controllers and operators against it. Each controller polls its
+station's active job, reports the job finished or failed once it has
+run, and claims the next job from the queue. Each operator signs in,
+then browses the jobs, configs and insights pages, the plots and single
+jobs, pausing to read between pages. Prints throughput, latency
+percentiles and error rates per route. Needs no network access, and the
+same `--seed` replays the same run. The database is deleted afterwards
+unless `--keep` is given. Run from the root directory:
+
+    python3 load_test.py --controllers 20 --operators 5 --duration 60
+
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+PASSWORD = 'load-test'
+
+# Operator pages as (weight, route, path), where `{job_id}` is filled
+# with a random seeded job
+OPERATOR_PAGES = [
+    (35, '/', '/'),
+    (15, '/configs', '/configs'),
+    (10, '/insights', '/insights'),
+    (8, '/durations-plot.png', '/durations-plot.png'),
+    (8, '/status-plot.png', '/status-plot.png'),
+    (8, '/config-plot.png', '/config-plot.png'),
+    (16, '/job/<id>', '/job/{job_id}'),
+]
+
+
+def configure(directory):
+    '''Points the app at a new database in `directory`. Must run before
+    the app is imported.
+
+    '''
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "load_test.db")}'
+    os.environ.setdefault('FLASK_SECRET_KEY', 'load-test')
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+    os.environ.setdefault('CACHE_SQLITE_PATH', os.path.join(directory, 'cache.db'))
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+    os.environ.setdefault('RATE_LIMIT_SQLITE_PATH', os.path.join(directory, 'rate_limits.db'))
+
+
+def seed_database(controllers, operators, configs, history, queued, rng):
+    '''Creates one station and API key per controller, the operators'
+    accounts, configs, finished job history and a queue of jobs. Returns
+    the station API keys, operator emails and job ids.
+
+    '''
+    from datetime import datetime, timedelta
+    from app import app, db, hashing, models
+
+    with app.app_context():
+        db.create_all()
+        password = hashing.hash_password(PASSWORD)
+        users = [models.User(email=f'operator{i}@email.com', password=password, settings=models.UserSettings()) for i in range(operators)]
+        stations = [models.Station(name=f'Station #{i + 1}') for i in range(controllers)]
+        plug_configs = [
+            models.PlugConfig(
+                f'Plug Type #{i + 1}', ''.join(rng.choice('01') for _ in range(8)), *(round(rng.uniform(0.1, 5), 2) for _ in range(12))
+            )
+            for i in range(configs)
+        ]
+        db.session.add_all(users + stations + plug_configs)
+        db.session.commit()
+
+        now = datetime.now()
+        statuses = [models.StatusEnum.finished] * 8 + [models.StatusEnum.failed, models.StatusEnum.stopped]
+        rows = []
+        for i in range(history):
+            start_time = now - timedelta(minutes=rng.randint(10, 60 * 24 * 30))
+            duration = rng.uniform(60, 1800)
+            rows.append({
+                'config_id': rng.choice(plug_configs).id,
+                'station_id': rng.choice(stations).id,
+                'start_time': start_time,
+                'end_time': start_time + timedelta(seconds=duration),
+                'duration': duration,
+                'status': rng.choice(statuses),
+                'notes': '',
+                'priority': 0,
+            })
+        rows.extend({
+            'config_id': rng.choice(plug_configs).id,
+            'station_id': None,
+            'queued_time': now,
+            'status': models.StatusEnum.queued,
+            'notes': '',
+            'priority': rng.randint(0, 2),
+        } for _ in range(queued))
+        db.session.execute(db.insert(models.PlugJob), rows)
+
+        api_keys = [models.APIKey(name='load test', user_id=users[0].id, station_id=station.id) for station in stations]
+        db.session.add_all(api_keys)
+        db.session.commit()
+        return (
+            [api_key.key for api_key in api_keys],
+            [user.email for user in users],
+            [id for id, in db.session.query(models.PlugJob.id).filter(models.PlugJob.end_time.isnot(None))],
+        )
+
+
+class Recorder():
+    '''Collects `(route, latency, status)` results from every simulated
+    client, dropping those that start before `record_after`.
+
+    '''
+
+    def __init__(self, record_after):
+        self.record_after = record_after
+        self.results = []
+        self.lock = threading.Lock()
+
+    def request(self, opener, route, url, body=None, method='GET', form=None):
+        if body is not None:
+            data, content_type = json.dumps(body).encode(), 'application/json'
+        elif form is not None:
+            data, content_type = urllib.parse.urlencode(form).encode(), 'application/x-www-form-urlencoded'
+        else:
+            data, content_type = None, None
+        request = urllib.request.Request(url, data=data, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        start = time.time()
+        try:
+            with opener.open(request, timeout=60) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            content, status = e.read(), e.code
+        except (urllib.error.URLError, OSError):
+            content, status = b'', 0
+        if start >= self.record_after:
+            with self.lock:
+                self.results.append((route, time.time() - start, status))
+        return status, content
+
+
+def run_controller(base_url, api_key, recorder, deadline, rng, poll_interval, job_seconds, failure_rate):
+    opener = urllib.request.build_opener()
+    body = {'api_key': api_key}
+    active, finish_at = None, 0
+    while time.time() < deadline:
+        status, content = recorder.request(opener, '/api/active GET', base_url + '/api/active', body)
+        if status == 200:
+            response = json.loads(content)
+            if response['changed']:
+                body['since'] = response['version']
+                jobs = response['data']
+                if jobs and (active is None or jobs[0]['id'] != active):
+                    active, finish_at = jobs[0]['id'], time.time() + rng.expovariate(1 / job_seconds)
+                elif not jobs:
+                    active = None
+
+        if active is not None and time.time() >= finish_at:
+            outcome = 'failed' if rng.random() < failure_rate else 'finished'
+            recorder.request(opener, '/api/active POST', base_url + '/api/active', {'api_key': api_key, 'id': active, 'status': outcome}, 'POST')
+            active = None
+        if active is None:
+            recorder.request(opener, '/api/claim', base_url + '/api/claim', {'api_key': api_key, 'include_config': False}, 'POST')
+        time.sleep(max(0, rng.gauss(poll_interval, poll_interval / 10)))
+
+
+def run_operator(base_url, email, job_ids, recorder, deadline, rng, think_time):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    weights = [page[0] for page in OPERATOR_PAGES]
+    _, content = recorder.request(opener, '/ sign in form', base_url + '/')
+    csrf_token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', content)
+    form = {'csrf_token': csrf_token.group(1).decode() if csrf_token else '', 'email': email, 'password': PASSWORD}
+    recorder.request(opener, '/ sign in', base_url + '/', form=form, method='POST')
+    while time.time() < deadline:
+        _, route, path = rng.choices(OPERATOR_PAGES, weights)[0]
+        recorder.request(opener, route, base_url + path.format(job_id=rng.choice(job_ids)))
+        time.sleep(rng.expovariate(1 / think_time))
+
+
+def report(results, duration):
+    from benchmark import percentile
+
+    print(f'{"Route":<22} {"Requests":>8} {"Req/s":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"429":>5} {"Errors":>7}')
+    summary = {}
+    routes = sorted({route for route, _, _ in results})
+    for route in routes + ['Total']:
+        rows = [result for result in results if route in ('Total', result[0])]
+        latencies = [latency * 1000 for _, latency, status in rows if 0 < status < 400]
+        limited = sum(1 for _, _, status in rows if status == 429)
+        errors = sum(1 for _, _, status in rows if status == 0 or (status >= 400 and status != 429))
+        summary[route] = {
+            'requests': len(rows),
+            'throughput': len(rows) / duration,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'rate_limited': limited,
+            'error_rate': errors / len(rows) if rows else 0,
+        }
+        row = summary[route]
+        print(
+            f'{route:<22} {row["requests"]:>8} {row["throughput"]:>7.1f} {row["p50"]:>8.1f} {row["p95"]:>8.1f} '
+            f'{row["p99"]:>8.1f} {limited:>5} {row["error_rate"]:>7.1%}'
+        )
+    return summary
+
+
+def run(controllers=20, operators=5, duration=60, warmup=5, seed=1, configs=20, history=20000, poll_interval=1.0,
+        job_seconds=20.0, failure_rate=0.05, think_time=5.0, port=8770, server_env=None, output=None, keep=False):
+    '''Runs the load test and returns its summary. The temporary
+    directory with the database is deleted afterwards unless `keep`.
+
+    '''
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix='load_test_')
+    try:
+        configure(directory)
+        from benchmark import start_server, stop_server
+
+        queued = int(controllers * (warmup + duration) / job_seconds * 2) + controllers
+        api_keys, emails, job_ids = seed_database(controllers, operators, configs, history, queued, rng)
+        print(f'Seeded {directory}: {controllers} stations, {operators} operators, {history} jobs, {queued} queued')
+
+        server = start_server(port, env=server_env)
+        base_url = f'http://127.0.0.1:{port}'
+        start = time.time()
+        recorder = Recorder(record_after=start + warmup)
+        deadline = start + warmup + duration
+        try:
+            with ThreadPoolExecutor(max_workers=controllers + operators) as executor:
+                futures = [
+                    executor.submit(run_controller, base_url, api_key, recorder, deadline, random.Random(rng.random()),
+                                    poll_interval, job_seconds, failure_rate)
+                    for api_key in api_keys
+                ]
+                futures += [
+                    executor.submit(run_operator, base_url, email, job_ids, recorder, deadline, random.Random(rng.random()), think_time)
+                    for email in emails
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            stop_server(server)
+    finally:
+        if keep:
+            print(f'Kept {directory}')
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    summary = report(recorder.results, duration)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs an end-to-end load test against a local gunicorn.')
+    parser.add_argument('--controllers', type=int, default=20)
+    parser.add_argument('--operators', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured after the warmup')
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--history', type=int, default=20000, help='finished jobs seeded into the database')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--job-seconds', type=float, default=20.0, help='mean time a controller takes per job')
+    parser.add_argument('--think-time', type=float, default=5.0, help='mean seconds an operator spends on a page')
+    parser.add_argument('--workers', help='WEB_CONCURRENCY for gunicorn')
+    parser.add_argument('--worker-class', help='GUNICORN_WORKER_CLASS for gunicorn')
+    parser.add_argument('--port', type=int, default=8770)
+    parser.add_argument('--output', help='also write the summary to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory with the database')
+    args = parser.parse_args()
+
+    server_env = {}
+    if args.workers:
+        server_env['WEB_CONCURRENCY'] = args.workers
+    if args.worker_class:
+        server_env['GUNICORN_WORKER_CLASS'] = args.worker_class
+    run(
+        controllers=args.controllers, operators=args.operators, duration=args.duration, warmup=args.warmup, seed=args.seed,
+        history=args.history, poll_interval=args.poll_interval, job_seconds=args.job_seconds, think_time=args.think_time,
+        port=args.port, server_env=server_env, output=args.output, keep=args.keep
+    )
@@ -1,18 +1,23 @@
 '''Module for manging database operations.
 
 '''
+import numpy as np
+
 from datetime import datetime, timedelta
 import os
 import random
 import getpass
 
-from app import app, db, bcrypt, models
+from app import app, db, bcrypt, cure, models, replicas, search
 
 
 def create_prod():
     with app.app_context():
         db.create_all()
 
+        station = models.Station(name='Station #1')
+        station.save()
+
         admin = models.User(
             email=os.environ.get('EMAIL'),
             password=bcrypt.generate_password_hash(os.environ.get('PASSWORD')).decode('utf-8'),
@@ -37,6 +42,11 @@ def create_dev():
             )
             user.save()
 
+        # Station test data
+        for i in range(1, 3):
+            station = models.Station(name='Station #{}'.format(i))
+            station.save()
+
         # PlugConfig test data
         for i in range(4, 8):
             plug = models.PlugConfig(
@@ -61,12 +71,15 @@ def create_dev():
         for i in range(100):
             job = models.PlugJob(
                 config_id=random.randint(1, 4),
-                start_time=datetime.now() - timedelta(minutes=random.randint(20, 100))
+                start_time=datetime.now() - timedelta(minutes=random.randint(20, 100)),
+                station_id=random.randint(1, 2)
             )
             job.end_time = job.start_time + timedelta(minutes=random.randint(20, 100))
-            job.duration = round((job.end_time - job.start_time).total_seconds() / 60, 2)
+            # In seconds, like `PlugJob.set_ended`
+            job.duration = (job.end_time - job.start_time).total_seconds()
             status_list = list(models.StatusEnum)
             status_list.remove(models.StatusEnum.started)
+            status_list.remove(models.StatusEnum.queued)
             job.status = random.choice(status_list)
 
             rand = random.random()
@@ -79,6 +92,10 @@ def create_dev():
 
             job.save()
 
+        search.rebuild()
+        models.DurationStats.rebuild()
+        db.session.commit()
+
 
 def create_user(email, password):
     with app.app_context():
@@ -90,6 +107,210 @@ def create_user(email, password):
         user.save()
 
 
+def create_station(name):
+    with app.app_context():
+        station = models.Station(name=name)
+        station.save()
+
+
+def rebuild_search_index():
+    with app.app_context():
+        search.rebuild()
+
+
+def rebuild_duration_stats():
+    with app.app_context():
+        models.DurationStats.rebuild()
+        db.session.commit()
+
+
+def table_columns(table):
+    return {column['name'] for column in db.inspect(db.engine).get_columns(table)}
+
+
+def add_config_versions():
+    '''Adds the `plug_config.version` column, which every config query
+    reads, to a database created before configs were versioned. The
+    first step of upgrading such a database.
+
+    '''
+    with app.app_context():
+        if 'version' in table_columns('plug_config'):
+            print('Configs are already versioned')
+            return
+        db.session.execute(db.text('ALTER TABLE plug_config ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        db.session.commit()
+
+
+def create_tables():
+    '''Creates missing tables, and the missing indexes of existing tables
+    whose columns all exist.
+
+    '''
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            inspector = db.inspect(connection)
+            for table in db.metadata.sorted_tables:
+                columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for index in table.indexes:
+                    if {column.name for column in index.columns} <= columns:
+                        index.create(connection, checkfirst=True)
+
+
+def add_stations():
+    '''Adds the station columns of jobs, API keys and user settings to a
+    database created before stations existed, and a first station if
+    there is none. Existing jobs move to that station, except started
+    jobs older than the newest, as a station runs one job at a time.
+    Existing keys and settings keep no station, so they cover every
+    station.
+
+    '''
+    create_tables()
+    with app.app_context():
+        added = False
+        for table in ('plug_job', 'api_key', 'user_settings'):
+            if 'station_id' not in table_columns(table):
+                db.session.execute(db.text(f'ALTER TABLE {table} ADD COLUMN station_id INTEGER REFERENCES station (id)'))
+                added = True
+        db.session.commit()
+        if not added:
+            print('Stations are already set up')
+            return
+
+        station = models.Station.query_ordered().first()
+        if station is None:
+            station = models.Station(name='Station #1')
+            station.save()
+        db.session.execute(
+            db.text("UPDATE plug_job SET station_id = :station_id WHERE status != 'started'"),
+            {'station_id': station.id}
+        )
+        db.session.execute(
+            db.text("UPDATE plug_job SET station_id = :station_id WHERE id = (SELECT max(id) FROM plug_job WHERE status = 'started')"),
+            {'station_id': station.id}
+        )
+        left = db.session.execute(db.text("SELECT count(*) FROM plug_job WHERE status = 'started' AND station_id IS NULL")).scalar()
+        db.session.commit()
+        if left:
+            print(f'{left} older started jobs have no station. Stop them from the jobs page.')
+    # The one active job per station index needs the new columns
+    create_tables()
+
+
+def add_job_queue():
+    '''Adds the priority and queued time columns of jobs, the `queued`
+    status and the queue index to a database created before the job
+    queue existed.
+
+    '''
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            # A new enum value cannot be added inside a transaction block
+            # on older PostgreSQL, nor used in the one that adds it
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                status_type = models.PlugJob.__table__.c.status.type.name
+                connection.execute(db.text(f"ALTER TYPE {status_type} ADD VALUE IF NOT EXISTS 'queued'"))
+        columns = table_columns('plug_job')
+        if 'priority' not in columns:
+            db.session.execute(db.text('ALTER TABLE plug_job ADD COLUMN priority INTEGER NOT NULL DEFAULT 0'))
+        if 'queued_time' not in columns:
+            column_type = db.DateTime().compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE plug_job ADD COLUMN queued_time {column_type}'))
+        db.session.commit()
+    create_tables()
+
+
+def pack_config_geometry():
+    '''Moves the plug measurements of a database created before they were
+    packed into `plug_config.geometry`. With the app stopped, back up the
+    database, deploy the new code and run this once before starting it:
+
+    1. Adds the `geometry` column, nullable until it is filled.
+    2. Packs each config's 12 measurement columns into it.
+    3. Drops the 12 columns, which new configs no longer fill in, and on
+       PostgreSQL makes `geometry` NOT NULL.
+
+    All steps run in one transaction on PostgreSQL. SQLite commits its
+    schema changes as it goes, so restore the backup if it fails there.
+
+    '''
+    with app.app_context():
+        columns = table_columns('plug_config')
+        if not columns.issuperset(models.GEOMETRY_FIELDS):
+            print('The measurements are already packed')
+            return
+
+        if 'geometry' not in columns:
+            column_type = db.LargeBinary(models.GEOMETRY_SIZE).compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE plug_config ADD COLUMN geometry {column_type}'))
+        rows = db.session.execute(db.text(f'SELECT id, {", ".join(models.GEOMETRY_FIELDS)} FROM plug_config')).all()
+        if rows:
+            db.session.execute(
+                db.text('UPDATE plug_config SET geometry = :geometry WHERE id = :id'),
+                [{'id': id, 'geometry': np.array(values, dtype=models.GEOMETRY_DTYPE).tobytes()} for id, *values in rows]
+            )
+        for field in models.GEOMETRY_FIELDS:
+            db.session.execute(db.text(f'ALTER TABLE plug_config DROP COLUMN {field}'))
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('ALTER TABLE plug_config ALTER COLUMN geometry SET NOT NULL'))
+        db.session.commit()
+        print(f'Packed the measurements of {len(rows)} configs')
+
+
+def compile_cure_schedules():
+    '''Compiles every config's cure profile into `cure_schedule`, adding
+    the column to a database created before schedules existed. Also run
+    it after a change to the schedule format. Configs whose profile is
+    no longer valid are listed, to fix on their edit page before running
+    this again. On PostgreSQL, `cure_schedule` is made NOT NULL once every
+    config has one.
+
+    '''
+    with app.app_context():
+        if 'cure_schedule' not in table_columns('plug_config'):
+            column_type = db.LargeBinary(cure.MAX_SCHEDULE_SIZE).compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE plug_config ADD COLUMN cure_schedule {column_type}'))
+            db.session.commit()
+
+        invalid = []
+        for config in models.PlugConfig.query.order_by(models.PlugConfig.id):
+            try:
+                # Unchanged schedules are not written, so their configs keep their version
+                config.cure_schedule = cure.compile_profile(config.cure_profile)
+            except cure.InvalidProfile as e:
+                invalid.append(f'{config.id} {config.name}: {e}')
+        db.session.commit()
+        if invalid:
+            print('Fix the cure profiles of these configs and run this again:', *invalid, sep='\n')
+        elif db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('ALTER TABLE plug_config ALTER COLUMN cure_schedule SET NOT NULL'))
+            db.session.commit()
+
+
+def sync_sqlite_replicas():
+    '''Copies a SQLite primary into every SQLite replica in
+    `REPLICA_DATABASE_URLS`, so routing can be tried locally. Replicas
+    only change when this is run again, which makes lag easy to see.
+
+    '''
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            print('The primary database is not SQLite')
+            return
+        primary = db.engine.raw_connection()
+        try:
+            for key in replicas.replica_keys(db.engines):
+                replica = db.engines[key].raw_connection()
+                try:
+                    primary.driver_connection.backup(replica.driver_connection)
+                finally:
+                    replica.close()
+        finally:
+            primary.close()
+
+
 def delete_all(confirm=False):
     if confirm:
         with app.app_context():